@@ -0,0 +1,45 @@
+"""
+Compare event loop implementations using a captured workload
+
+Replays a capture (see --capture) once for every event loop implementation
+and prints the replay reports side by side:
+
+    python3 benchmark.py capture.jsonl.gz --speed 100
+"""
+
+import sys
+import argparse
+import subprocess
+
+from tools import LOOPS
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("capture")
+    parser.add_argument("--basedir", default="..")
+    parser.add_argument("--speed", type=float, default=100.0)
+    parser.add_argument("--loops", nargs="+", choices=LOOPS, default=LOOPS)
+    args = parser.parse_args()
+
+    for loop in args.loops:
+        print(f"=== {loop} ===", flush=True)
+        subprocess.run(
+            [
+                sys.executable,
+                "gateway.py",
+                "--basedir",
+                args.basedir,
+                "--loop",
+                loop,
+                "--replay",
+                args.capture,
+                "--speed",
+                str(args.speed),
+            ],
+            check=True,
+        )
+
+
+if __name__ == "__main__":
+    main()
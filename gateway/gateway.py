@@ -2,7 +2,7 @@ import asyncio
 import logging
 import secrets
 import argparse
-import uuid
+import signal
 import os
 
 from contextlib import AsyncExitStack, suppress
@@ -12,30 +12,50 @@ from bluetooth_mesh.crypto import ApplicationKey, DeviceKey, NetworkKey
 from bluetooth_mesh.messages.config import GATTNamespaceDescriptor
 from bluetooth_mesh import models
 
-from tools import Config, Store, Tasks
-from mesh import Node, NodeManager
+from tools import (
+    LOOPS,
+    Config,
+    FileWatcher,
+    LoopWatchdog,
+    Profiler,
+    Shard,
+    Store,
+    Tasks,
+    install_loop,
+    setup_logging,
+    tracer,
+)
+from tools.capture import RecordingClient, recorder
+from tools.replay import Replayer
+from mesh import Area, Node, NodeManager, Scene
 from mqtt import HassMqttMessenger
 
 from modules.provisioner import ProvisionerModule
 from modules.scanner import ScannerModule
 from modules.manager import ManagerModule
+from modules.topology import TopologyModule
+from modules.calibration import CalibrationModule
 
 from mesh.nodes.light import Light
+from mesh.nodes.sensor import Sensor
 
 
-logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger("gateway")
 
 
 MESH_MODULES = {
     "prov": ProvisionerModule(),
     "scan": ScannerModule(),
     "mgmt": ManagerModule(),
+    "topo": TopologyModule(),
+    "calib": CalibrationModule(),
 }
 
 
 NODE_TYPES = {
     "generic": Node,
     "light": Light,
+    "sensor": Sensor,
 }
 
 
@@ -51,6 +71,8 @@ class MainElement(Element):
         models.GenericOnOffClient,
         models.LightLightnessClient,
         models.LightCTLClient,
+        models.SceneClient,
+        models.SensorClient,
     ]
 
 
@@ -65,18 +87,37 @@ class MqttGateway(Application):
     CRPL = 32768
     PATH = "/org/hass/mesh"
 
-    def __init__(self, loop, basedir):
+    def __init__(self, loop, basedir, shard=None, readonly=False):
         super().__init__(loop)
 
-        self._store = Store(location=os.path.join(basedir, "store.yaml"))
-        self._config = Config(os.path.join(basedir, "config.yaml"))
+        # every shard keeps its own store
+        store = f"store.{shard}.yaml" if shard else "store.yaml"
+
+        self._store = Store(location=os.path.join(basedir, store), readonly=readonly)
+        self._config_path = os.path.join(basedir, "config.yaml")
+        self._config = Config(self._config_path)
+        setup_logging(self._config)
+
+        self._shard = Shard(self._config, shard)
+
+        tracer.configure(self._config, basedir)
+        self._watchdog = LoopWatchdog(self._config)
+        self._profiler = Profiler(self._config, basedir)
+
         self._nodes = {}
+        self._scenes = []
+        self._areas = []
 
         self._messenger = None
+        self._tasks = None
+        self._clients = {}
+        # running bind task per node
+        self._binds = {}
 
         self._app_keys = None
         self._dev_key = None
         self._primary_net_key = None
+        self._net_keys = None
         self._new_keys = set()
 
         # load mesh modules
@@ -97,19 +138,73 @@ class MqttGateway(Application):
             raise Exception("Primary network key not ready")
         return 0, self._primary_net_key
 
+    @property
+    def net_keys(self):
+        if not self._net_keys:
+            raise Exception("Network keys not ready")
+        return self._net_keys
+
     @property
     def app_keys(self):
         if not self._app_keys:
             raise Exception("Application keys not ready")
         return self._app_keys
 
+    def app_key(self, app_index):
+        """
+        Get the application key tuple for the given index
+        """
+        for app_key in self.app_keys:
+            if app_key[0] == app_index:
+                return app_key
+        raise Exception(f"Unknown application key {app_index}")
+
+    def client(self, model):
+        """
+        Get a client model of the main element
+
+        Clients are recorded while capturing and replaced by stubs on replay.
+        """
+        client = self._clients.get(model)
+        if client is None:
+            client = self.elements[0][model]
+            if recorder.enabled:
+                client = RecordingClient(client, recorder)
+            self._clients[model] = client
+        return client
+
+    def _key_name(self, kind, index):
+        # keychain entry of a key, keys with index 0 are stored without suffix
+        name = {"net": "network_key", "app": "app_key"}[kind]
+        return f"{name}_{index}" if index else name
+
     @property
     def nodes(self):
         return self._nodes
 
+    @property
+    def scenes(self):
+        return self._scenes
+
+    @property
+    def areas(self):
+        return self._areas
+
+    @property
+    def shard(self):
+        return self._shard
+
+    @property
+    def modules(self):
+        return MESH_MODULES
+
+    @property
+    def profiler(self):
+        return self._profiler
+
     def _load_key(self, keychain, name):
         if name not in keychain:
-            logging.info(f"Generating {name}...")
+            logger.info("Generating %s...", name)
             keychain[name] = secrets.token_hex(16)
             self._new_keys.add(name)
         try:
@@ -123,55 +218,242 @@ class MqttGateway(Application):
         nodes = self._store.section("nodes")
 
         # load or set application parameters
-        self.address = local.get("address", 1)
+        self.address = local.get("address", self._shard.address_range[0])
         self.iv_index = local.get("iv_index", 5)
 
         # load or generate keys
         self._dev_key = DeviceKey(self._load_key(keychain, "device_key"))
-        self._primary_net_key = NetworkKey(self._load_key(keychain, "network_key"))
+        self._primary_net_key = NetworkKey(self._load_key(keychain, self._key_name("net", 0)))
+        self._net_keys = {0: self._primary_net_key}
         self._app_keys = [
-            # currently just a single application key supported
-            (0, 0, ApplicationKey(self._load_key(keychain, "app_key"))),
+            (0, 0, ApplicationKey(self._load_key(keychain, self._key_name("app", 0)))),
         ]
 
+        # additional subnets and application keys used by areas
+        areas = self._config.optional("areas", None) or {}
+        for name, area in areas.items():
+            net_index = area.get("net_index", 0)
+            app_index = area.get("app_index", 0)
+
+            if net_index not in self._net_keys:
+                key = self._load_key(keychain, self._key_name("net", net_index))
+                self._net_keys[net_index] = NetworkKey(key)
+
+            bound = [app_key[1] for app_key in self._app_keys if app_key[0] == app_index]
+            if bound and bound[0] != net_index:
+                raise Exception(f"Application key {app_index} of area {name} is bound to subnet {bound[0]}")
+            if not bound:
+                key = self._load_key(keychain, self._key_name("app", app_index))
+                self._app_keys.append((app_index, net_index, ApplicationKey(key)))
+
         # initialize node manager
         self._nodes = NodeManager(nodes, self._config, NODE_TYPES)
 
+        # initialize scenes
+        scenes = self._config.optional("scenes", None) or {}
+        self._scenes = [
+            Scene(id, info, self._nodes) for id, info in scenes.items() if self._shard.owns(id, Config(config=info))
+        ]
+
+        # initialize area aggregates
+        self._areas = [
+            Area(id, area, self._nodes)
+            for id, area in areas.items()
+            if area.get("summary", False) and self._shard.owns(f"area_{id}", Config(config=area))
+        ]
+
         # initialize MQTT messenger
-        self._messenger = HassMqttMessenger(self._config, self._nodes)
+        self._messenger = HassMqttMessenger(self._config, self._nodes, self._store.section("mqtt"), self._shard)
 
         # persist changes
         self._store.set("keychain", keychain)
         self._store.persist()
 
+    async def _add_keys(self):
+        """
+        Add all keys to the local node
+
+        Application keys are bound to a subnet, so the subnets of areas are
+        added to the local node before their application keys.
+        """
+        client = self.client(models.ConfigClient)
+
+        for net_index, net_key in self.net_keys.items():
+            if self._key_name("net", net_index) in self._new_keys:
+                # register network key as subnet key
+                await self.management_interface.import_subnet(net_index, net_key)
+                logger.info("Imported net key %s as subnet key", net_index)
+
+            # the primary subnet is part of the local node since its creation
+            if net_index == 0:
+                continue
+            try:
+                await client.add_net_key(self.address, net_index=0, net_key_index=net_index, net_key=net_key)
+            except:
+                logger.exception("Failed to add net key %s", net_index)
+
+        for app_key in self.app_keys:
+            try:
+                # set application key
+                await self.add_app_key(*app_key)
+            except:
+                logger.exception("Failed to set app key %s", app_key[0])
+
+                # try to re-add application key
+                try:
+                    await self.delete_app_key(app_key[0], app_key[1])
+                    await self.add_app_key(*app_key)
+                except:
+                    logger.exception("Failed to re-add app key %s", app_key[0])
+
     async def _import_keys(self):
-        logging.info("Importing keys...")
-
-        if "primary_net_key" in self._new_keys:
-            # register primary network key as subnet key
-            await self.management_interface.import_subnet(0, self.primary_net_key[1])
-            logging.info("Imported primary net key as subnet key")
-
-        if "app_key" in self._new_keys:
-            # import application key into daemon
-            await self.management_interface.import_app_key(*self.app_keys[0])
-            logging.info("Imported app key")
-
-        # update application key for client models
-        client = self.elements[0][models.GenericOnOffClient]
-        await client.bind(self.app_keys[0][0])
-        client = self.elements[0][models.LightLightnessClient]
-        await client.bind(self.app_keys[0][0])
-        client = self.elements[0][models.LightCTLClient]
-        await client.bind(self.app_keys[0][0])
+        logger.info("Importing keys...")
+
+        for app_key in self.app_keys:
+            if self._key_name("app", app_key[0]) in self._new_keys:
+                # import application key into daemon
+                await self.management_interface.import_app_key(*app_key)
+                logger.info("Imported app key %s", app_key[0])
+
+        # update application keys for client models
+        for model in (
+            models.GenericOnOffClient,
+            models.LightLightnessClient,
+            models.LightCTLClient,
+            models.SceneClient,
+            models.SensorClient,
+        ):
+            client = self.elements[0][model]
+            for app_key in self.app_keys:
+                await client.bind(app_key[0])
 
     async def _try_bind_node(self, node):
         try:
             await node.bind(self)
-            logging.info(f"Bound node {node}")
+            logger.info("Bound node %s", node)
             node.ready.set()
+
+            # scenes skip members that were not ready in time
+            for scene in self._scenes:
+                await scene.bind_member(node)
+        except asyncio.CancelledError:
+            raise
         except:
-            logging.exception(f"Failed to bind node {node}")
+            logger.exception("Failed to bind node %s", node)
+
+    async def update_node(self, uuid):
+        """
+        Start serving a new or reconfigured node without restarting
+
+        Does nothing unless the gateway is running.
+        """
+        if self._tasks is None:
+            return
+
+        await self._messenger.remove(self._nodes.get(uuid))
+
+        previous = self._nodes.get(uuid)
+        if previous is not None:
+            previous.stop()
+
+        # a replaced node must not be bound anymore
+        bind = self._binds.pop(uuid, None)
+        if bind is not None:
+            bind.cancel()
+
+        node = self._nodes.reload(uuid)
+        self._binds[uuid] = self._tasks.spawn(self._try_bind_node(node), f"bind {node}")
+        self._messenger.add(node)
+
+        for area in self._areas:
+            if previous is not None:
+                area.detach(previous)
+            area.attach(node)
+
+    async def remove_node(self, node):
+        """
+        Stop serving a removed node without restarting
+
+        Does nothing unless the gateway is running.
+        """
+        if self._tasks is None:
+            return
+
+        await self._messenger.remove(node, clear=True)
+        node.stop()
+
+        bind = self._binds.pop(node.uuid, None)
+        if bind is not None:
+            bind.cancel()
+
+        for area in self._areas:
+            area.detach(node)
+
+    async def _reload_config(self):
+        """
+        Apply changes of the mesh configuration to the running gateway
+        """
+        previous = {key: value for key, value in self._config.items() if key != "mesh"}
+        self._config.load()
+        current = {key: value for key, value in self._config.items() if key != "mesh"}
+
+        logger.info("Configuration changed")
+        if previous != current:
+            logger.warning("Configuration changes outside of mesh require a restart")
+
+        for node in list(self._nodes.all()):
+            before = node.config
+            after = self._config.node_config(node.uuid)
+            if dict(before.items()) == dict(after.items()):
+                continue
+
+            # node was added, removed or changed its identity
+            if after.optional("id") != before.optional("id") or after.optional("type") != before.optional("type"):
+                if before.optional("id"):
+                    logger.info("Removing %s", node)
+                    await self.remove_node(node)
+
+                node.config = after
+                if after.optional("id"):
+                    logger.info("Adding %s", node)
+                    await self.update_node(node.uuid)
+                continue
+
+            node.config = after
+
+            # models are bound to the application key of the node's area
+            app_index_changed = after.optional("app_index", 0) != before.optional("app_index", 0)
+            if app_index_changed or after.optional("area") != before.optional("area"):
+                logger.info("Rebinding %s", node)
+                try:
+                    # the node needs the application key before its models are bound, configuring restarts the node
+                    if app_index_changed:
+                        await MESH_MODULES["prov"]._configure(node)
+                    else:
+                        await self.update_node(node.uuid)
+                except:
+                    logger.exception("Failed to rebind %s", node)
+                continue
+
+            if after.optional("relay", False) != before.optional("relay", False):
+                try:
+                    await MESH_MODULES["prov"]._set_relay(node)
+                except:
+                    logger.exception("Failed to set relay state of %s", node)
+
+            # unchanged discovery messages are skipped
+            await self._messenger.refresh(node)
+
+    def persist(self):
+        """
+        Persist all nodes including their last known state
+        """
+        self._nodes.persist()
+
+    async def _persist_snapshots(self, interval):
+        while True:
+            await asyncio.sleep(interval)
+            self.persist()
 
     def scan_result(self, rssi, data, options):
         MESH_MODULES["scan"]._scan_result(rssi, data, options)
@@ -188,6 +470,46 @@ class MqttGateway(Application):
     def shutdown(self, tasks):
         self._messenger.shutdown()
 
+    def _serve(self, tasks):
+        """
+        Bind all nodes and scenes and start bridging them
+        """
+        self._tasks = tasks
+
+        # initialize all nodes
+        for node in self._nodes.all():
+            self._binds[node.uuid] = tasks.spawn(self._try_bind_node(node), f"bind {node}")
+
+        # initialize all scenes
+        for scene in self._scenes:
+            tasks.spawn(self._try_bind_node(scene), f"bind {scene}")
+
+        # initialize all areas
+        for area in self._areas:
+            tasks.spawn(self._try_bind_node(area), f"bind {area}")
+
+        # start MQTT task
+        tasks.spawn(self._messenger.run(self), "run messenger")
+
+    async def _profile(self):
+        try:
+            await self._profiler.profile()
+        except:
+            logger.exception("Failed to profile")
+
+    async def replay(self, args):
+        """
+        Feed a capture into the gateway without connecting to the daemon or broker
+        """
+        replayer = Replayer(args.replay, args.speed)
+
+        self._clients = {model: replayer.stub(model) for model in MainElement.MODELS}
+        self._messenger.client = replayer.loopback
+
+        async with Tasks() as tasks:
+            self._serve(tasks)
+            await replayer.run([*self._nodes.all(), *self._scenes])
+
     async def run(self, args):
         async with AsyncExitStack() as stack:
             tasks = await stack.enter_async_context(Tasks())
@@ -203,22 +525,13 @@ class MqttGateway(Application):
                 self._nodes.persist()
                 return
 
-            try:
-                # set overall application key
-                await self.add_app_key(*self.app_keys[0])
-            except:
-                logging.exception(f"Failed to set app key {self._app_keys[0][2].bytes.hex()}")
-
-                # try to re-add application key
-                await self.delete_app_key(self.app_keys[0][0], self.app_keys[0][1])
-                await self.add_app_key(*self.app_keys[0])
-
             # force reloading keys
             if args.reload:
-                self._new_keys.add("primary_net_key")
-                self._new_keys.add("app_key")
+                self._new_keys.update(self._key_name("net", net_index) for net_index in self.net_keys)
+                self._new_keys.update(self._key_name("app", app_key[0]) for app_key in self.app_keys)
 
             # configure all keys
+            await self._add_keys()
             await self._import_keys()
 
             # run user task if specified
@@ -226,12 +539,23 @@ class MqttGateway(Application):
                 await args.handler(args)
                 return
 
-            # initialize all nodes
-            for node in self._nodes.all():
-                tasks.spawn(self._try_bind_node(node), f"bind {node}")
+            self._serve(tasks)
+
+            # watch for event loop stalls
+            tasks.spawn(self._watchdog.run(self._messenger.publish_diagnostics), "watch event loop")
+
+            # capture a profile on request
+            loop = asyncio.get_running_loop()
+            loop.add_signal_handler(signal.SIGUSR1, lambda: tasks.spawn(self._profile(), "profile"))
 
-            # start MQTT task
-            tasks.spawn(self._messenger.run(self), "run messenger")
+            # keep last known state for the next start
+            interval = self._config.optional("snapshot_interval", 300)
+            tasks.spawn(self._persist_snapshots(interval), "persist snapshots")
+
+            # apply configuration changes
+            if self._config.optional("reload", True):
+                watcher = FileWatcher(self._config_path)
+                tasks.spawn(watcher.watch(self._reload_config), "watch configuration")
 
             # wait for all tasks
             await tasks.gather()
@@ -242,6 +566,11 @@ def main():
     parser.add_argument("--leave", action="store_true")
     parser.add_argument("--reload", action="store_true")
     parser.add_argument("--basedir", default="..")
+    parser.add_argument("--shard", default=None)
+    parser.add_argument("--capture", metavar="FILE", help="record traffic into a capture file")
+    parser.add_argument("--replay", metavar="FILE", help="replay a capture file against stubbed clients")
+    parser.add_argument("--speed", type=float, default=1.0, help="replay speed factor")
+    parser.add_argument("--loop", choices=LOOPS, help="event loop implementation (overrides config)")
 
     # module specific CLI interfaces
     subparsers = parser.add_subparsers()
@@ -252,11 +581,32 @@ def main():
 
     args = parser.parse_args()
 
+    if args.capture:
+        recorder.configure(args.capture)
+
+    # the event loop implementation must be chosen before the loop is created
+    config = Config(os.path.join(args.basedir, "config.yaml"))
+    loop_name = install_loop(args.loop or config.optional("loop", "asyncio"))
+
     loop = asyncio.get_event_loop()
-    app = MqttGateway(loop, args.basedir)
 
-    with suppress(KeyboardInterrupt):
-        loop.run_until_complete(app.run(args))
+    # replays never modify the store
+    app = MqttGateway(loop, args.basedir, args.shard, readonly=bool(args.replay))
+    logger.info("Using %s event loop", loop_name)
+
+    if args.replay:
+        loop.run_until_complete(app.replay(args))
+        return
+
+    # stop gracefully when the container is stopped
+    task = loop.create_task(app.run(args))
+    loop.add_signal_handler(signal.SIGTERM, task.cancel)
+
+    with suppress(KeyboardInterrupt, asyncio.CancelledError):
+        loop.run_until_complete(task)
+
+    # keep last known state for the next start
+    app.persist()
 
 
 if __name__ == "__main__":
@@ -1,2 +1,4 @@
+from .area import Area
 from .manager import NodeManager
 from .node import Node
+from .scene import Scene
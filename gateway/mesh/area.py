@@ -0,0 +1,157 @@
+import asyncio
+import logging
+
+import numpy as np
+
+from tools import Config
+
+
+logger = logging.getLogger(__name__)
+
+
+class Area:
+    """
+    Aggregated state of all lights within an area
+
+    The state of all lights is kept in arrays indexed by member node and
+    element, since every element of a node is a separate light. Arrays are
+    updated incrementally whenever a member changes, so computing the
+    aggregates never walks the state of the individual nodes. Slots of
+    removed lights are reused, arrays only grow when all slots are taken.
+
+    Provides the same interface as Node where required by MQTT bridges.
+    """
+
+    type = "area"
+
+    # brightness scale used by Home Assistant
+    BRIGHTNESS_SCALE = 50
+
+    def __init__(self, id, info, nodes):
+        self.config = Config(config={**info, "id": f"area_{id}", "name": info.get("name", id)})
+        self.area = id
+
+        self._nodes = nodes
+        self._members = {}
+        self._index = {}
+        self._free = []
+
+        self._active = np.zeros(0, dtype=bool)
+        self._on = np.zeros(0, dtype=bool)
+        self._dimmable = np.zeros(0, dtype=bool)
+        self._brightness = np.zeros(0, dtype=np.float64)
+
+        # set whenever an aggregate might have changed
+        self.changed = asyncio.Event()
+
+        # event system for area initialization
+        self.ready = asyncio.Event()
+
+    def __str__(self):
+        return f"{self.config.require('id')} (area {self.area})"
+
+    def _is_member(self, node):
+        return node.type == "light" and node.config.optional("area") == self.area
+
+    async def bind(self, app):
+        """
+        Track the state of all member nodes
+        """
+        for node in self._nodes.all():
+            self.attach(node)
+
+    def attach(self, node):
+        """
+        Track the state of a new or reconfigured node
+        """
+        self.detach(node)
+        if not self._is_member(node):
+            return
+
+        self._members[node.config.require("id")] = node
+        node.subscribe(self._update, resend=True)
+
+    def _slot(self, id, element):
+        # lights are added once their first state is known
+        if (id, element) not in self._index:
+            if not self._free:
+                self._grow()
+            self._index[(id, element)] = self._free.pop()
+
+        return self._index[(id, element)]
+
+    def _grow(self):
+        # double the capacity, so that arrays are rarely copied
+        size = len(self._on)
+        capacity = max(size * 2, 8)
+
+        self._active = np.concatenate((self._active, np.zeros(capacity - size, dtype=bool)))
+        self._on = np.concatenate((self._on, np.zeros(capacity - size, dtype=bool)))
+        self._dimmable = np.concatenate((self._dimmable, np.zeros(capacity - size, dtype=bool)))
+        self._brightness = np.concatenate((self._brightness, np.zeros(capacity - size, dtype=np.float64)))
+
+        # lowest slots are used first
+        self._free.extend(range(capacity - 1, size - 1, -1))
+
+    def detach(self, node):
+        """
+        Stop tracking a removed node
+        """
+        id = node.config.optional("id")
+        for member_id, member in list(self._members.items()):
+            if member is not node and member_id != id:
+                continue
+
+            for (light_id, element), index in list(self._index.items()):
+                if light_id == member_id:
+                    self._active[index] = self._on[index] = self._dimmable[index] = False
+                    self._brightness[index] = 0.0
+
+                    del self._index[(light_id, element)]
+                    self._free.append(index)
+
+            del self._members[member_id]
+            self.changed.set()
+
+    def _update(self, node, property, value, element=0):
+        id = node.config.optional("id")
+        if self._members.get(id) is not node:
+            return
+
+        index = self._slot(id, element)
+        self._active[index] = True
+
+        if property == "onoff":
+            self._on[index] = bool(value)
+        elif property == "brightness":
+            self._dimmable[index] = True
+            self._brightness[index] = value
+        else:
+            return
+
+        self.changed.set()
+
+    def subscribe(self, subscriber, resend=True):
+        """
+        Areas are published by their own bridge
+        """
+        pass
+
+    def retained_items(self, element=0):
+        return []
+
+    def stale(self, element=None, property=None):
+        return False
+
+    def state(self):
+        """
+        Compute all aggregates
+        """
+        dimmed = self._on & self._dimmable
+        brightness = self._brightness[dimmed].mean() if dimmed.any() else 0
+
+        return {
+            "on": int(np.count_nonzero(self._on)),
+            "total": int(np.count_nonzero(self._active)),
+            "brightness": round(float(brightness) * 100 / Area.BRIGHTNESS_SCALE),
+        }
@@ -0,0 +1,94 @@
+import time
+import asyncio
+import logging
+
+from .rtt import RoundTripTimer
+
+
+logger = logging.getLogger(__name__)
+
+
+class SetBatcher:
+    """
+    Collects acknowledged set requests into batches
+
+    Requests with identical parameters that arrive within a short window are
+    sent as a single request to all target nodes. Status replies are collected
+    in one wait. Only nodes that did not reply are retried, with a doubled
+    timeout on every retry.
+
+    The timeout is derived from the round trip timers of the target nodes.
+    If all nodes reply to the first attempt, the time until the last reply
+    is added to their timers.
+    """
+
+    def __init__(self, window=0.05, retries=2):
+        self._window = window
+        self._retries = retries
+        self._batches = {}
+        self._tasks = set()
+
+    async def request(self, client, method, unicast, app_index, *args, rtt, **kwargs):
+        """
+        Send an acknowledged set request to a node
+
+        Returns the status of the node or None if it did not reply.
+        """
+        key = (method, app_index, args, tuple(sorted(kwargs.items())))
+
+        batch = self._batches.get(key)
+        if batch is None:
+            batch = self._batches[key] = {}
+            task = asyncio.create_task(self._send(key, client, method, app_index, args, kwargs))
+            self._tasks.add(task)
+            task.add_done_callback(self._done)
+
+        if unicast not in batch:
+            batch[unicast] = (asyncio.get_running_loop().create_future(), rtt)
+        return await asyncio.shield(batch[unicast][0])
+
+    def _done(self, task):
+        self._tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error("Failed to send batch", exc_info=task.exception())
+
+    async def _send(self, key, client, method, app_index, args, kwargs):
+        await asyncio.sleep(self._window)
+        batch = self._batches.pop(key)
+
+        pending = sorted(batch)
+        timeout = max(rtt.timeout for _, rtt in batch.values())
+
+        try:
+            for attempt in range(self._retries + 1):
+                start = time.monotonic()
+                results = await getattr(client, method)(pending, app_index, *args, timeout=timeout, **kwargs)
+
+                for unicast in list(pending):
+                    result = results.get(unicast)
+                    if result is not None and not isinstance(result, BaseException):
+                        batch[unicast][0].set_result(result)
+                        pending.remove(unicast)
+
+                if not pending:
+                    # the reply time is only known if no node had to be retried
+                    if attempt == 0:
+                        elapsed = time.monotonic() - start
+                        for rtt in {rtt for _, rtt in batch.values()}:
+                            rtt.update(elapsed)
+                    break
+
+                timeout = min(timeout * 2, RoundTripTimer.MAX_TIMEOUT)
+                logger.info("%s of %s node(s) did not acknowledge %s", len(pending), len(batch), method)
+        except asyncio.CancelledError:
+            for future, _ in batch.values():
+                future.cancel()
+            raise
+        except Exception as e:
+            for future, _ in batch.values():
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for unicast in pending:
+            batch[unicast][0].set_result(None)
@@ -1,3 +1,10 @@
+def _plain(value):
+    # composition data is parsed into containers, that can not be persisted directly
+    if isinstance(value, dict):
+        return {key: _plain(item) for key, item in value.items() if not key.startswith("_")}
+    return value
+
+
 class Model:
     def __init__(self, data):
         self._model_id = data.get("model_id")
@@ -6,6 +13,9 @@ class Model:
     def model_id(self):
         return self._model_id
 
+    def yaml(self):
+        return {"model_id": _plain(self._model_id)}
+
 
 class Element:
     def __init__(self, data):
@@ -38,6 +48,12 @@ class Element:
 
         return False
 
+    def yaml(self):
+        return {
+            "sig_models": [model.yaml() for model in self._sig_models],
+            "vendor_models": [model.yaml() for model in self._vendor_models],
+        }
+
 
 class Composition:
     def __init__(self, data):
@@ -54,3 +70,9 @@ class Composition:
 
     def element(self, index):
         return self._elements[index]
+
+    def yaml(self):
+        """
+        Get the parts of the composition data used by the gateway
+        """
+        return {"elements": [element.yaml() for element in self._elements]}
@@ -3,6 +3,9 @@ import logging
 from uuid import UUID
 
 
+logger = logging.getLogger(__name__)
+
+
 class NodeManager:
     """
     Specific store to manage nodes
@@ -13,6 +16,7 @@ class NodeManager:
 
     def __init__(self, store, config, types):
         self._store = store
+        self._config = config
         self._types = types
         self._nodes = {}
 
@@ -32,7 +36,7 @@ class NodeManager:
         if node_config:
             user_typename = node_config.optional("type", typename)
             if user_typename != typename:
-                logging.warning(f'Node type changed for {uuid} from "{typename}" to "{user_typename}"')
+                logger.warning('Node type changed for %s from "%s" to "%s"', uuid, typename, user_typename)
 
                 typename = user_typename
                 info["type"] = typename
@@ -60,12 +64,22 @@ class NodeManager:
 
     def add(self, node):
         if str(node.uuid) in self._nodes:
-            logging.warning(f"Node {node} already exists")
+            logger.warning("Node %s already exists", node)
         self._nodes[str(node.uuid)] = node
 
     def create(self, uuid, info):
         self.add(self._make_node(uuid, info))
 
+    def reload(self, uuid):
+        """
+        Recreate a node instance using the current configuration
+
+        This is required once the type of a node changes.
+        """
+        node = self._nodes[str(uuid)]
+        self._nodes[str(uuid)] = self._make_node(node.uuid, node.yaml(), self._config.node_config(uuid))
+        return self._nodes[str(uuid)]
+
     def delete(self, uuid):
         del self._nodes[str(uuid)]
 
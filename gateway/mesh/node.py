@@ -11,17 +11,24 @@ class Node:
     event interface for other application components.
     """
 
-    def __init__(self, uuid, type, unicast, count, configured=False, config=None):
+    def __init__(self, uuid, type, unicast, count, configured=False, config=None, net_index=0, snapshot=None):
         self.uuid = uuid
         self.type = type
         self.unicast = unicast
         self.count = count
         self.configured = configured
         self.config = config or Config(config={})
+        # subnet the node was provisioned or configured with
+        self.net_index = net_index
 
-        # event system for property changes
-        self._retained = {}
+        # state persisted by a previous run
+        self._restored = snapshot or {}
+
+        # event system for property changes, state is retained per element
+        self._retained = self._restore_retained(self._restored.get("retained", {}))
         self._subscribers = set()
+        # restored properties that were not confirmed by the node yet
+        self._stale = {(element, property) for element, retained in self._retained.items() for property in retained}
         # event system for node initialization
         self.ready = asyncio.Event()
 
@@ -32,6 +39,27 @@ class Node:
             return f"{id} ({self.uuid}, {self.unicast:04})"
         return f"{self.uuid} ({self.unicast:04})"
 
+    @staticmethod
+    def _restore_retained(retained):
+        # previous snapshots only contain the state of the first element
+        if retained and not all(isinstance(key, int) for key in retained):
+            retained = {0: retained}
+        return {element: dict(properties) for element, properties in retained.items()}
+
+    @property
+    def elements(self):
+        """
+        Indexes of all elements exposed as separate entities
+        """
+        return [0]
+
+    @property
+    def app_index(self):
+        """
+        Application key used to communicate with the node
+        """
+        return self.config.optional("app_index", 0)
+
     async def bind(self, app):
         """
         Configure the node to work with the available mesh clients
@@ -41,46 +69,96 @@ class Node:
         """
         self._app = app
 
+    def stop(self):
+        """
+        Stop all background activity of a removed or replaced node
+        """
+        pass
+
     def subscribe(self, subscriber, resend=True):
         """
         Subscribe to state changes
         """
         self._subscribers.add(subscriber)
 
-        for property, value in self._retained.items():
-            subscriber(self, property, value)
+        for element, retained in self._retained.items():
+            for property, value in retained.items():
+                subscriber(self, property, value, element)
 
-    def notify(self, property, value):
+    def notify(self, property, value, element=0):
         """
         Notify all subscribers about state change
         """
-        self._retained[property] = value
+        self._retained.setdefault(element, {})[property] = value
+        self._stale.discard((element, property))
 
         for subscriber in self._subscribers:
-            subscriber(self, property, value)
+            subscriber(self, property, value, element)
+
+    def invalidate(self):
+        """
+        Mark all retained properties as outdated, i.e. after a scene recall
+
+        Subscribers are notified again, so that the state is published as stale.
+        """
+        self._stale = {(element, property) for element, retained in self._retained.items() for property in retained}
 
-    def retained(self, property, fallback):
+        for element, retained in self._retained.items():
+            for property, value in retained.items():
+                for subscriber in self._subscribers:
+                    subscriber(self, property, value, element)
+
+    def retained(self, property, fallback, element=0):
         """
         Get the latest value for that property
         """
-        return self._retained.get(property, fallback)
+        return self._retained.get(element, {}).get(property, fallback)
+
+    def stale(self, element=None, property=None):
+        """
+        Check if any property of an element or of the whole node still has its restored value
+        """
+        if property is not None:
+            return (element or 0, property) in self._stale
+        return any(element is None or stale == element for stale, _ in self._stale)
 
-    def print_info(self, additional=None):
-        print(
+    def snapshot(self):
+        """
+        Get the state that is persisted across restarts
+
+        Subclasses can extend the snapshot and restore it from
+        self._restored during initialization.
+        """
+        return {
+            "retained": {element: dict(retained) for element, retained in self._retained.items()},
+        }
+
+    def retained_items(self, element=0):
+        """
+        Get the latest values for all properties of an element
+        """
+        return list(self._retained.get(element, {}).items())
+
+    def print_info(self, additional=None, output=print):
+        """
+        Print node details using the given print function
+        """
+        output(
             f"\t{self.uuid}:\n"
             f"\t\ttype: {self.type}\n"
             f"\t\tunicast: {self.unicast} ({self.count})\n"
+            f"\t\tnet_index: {self.net_index}\n"
             f"\t\tconfigured: {self.configured}",
         )
 
         for key, value in self.config.items():
-            print(f"\t\t{key}: {value}")
+            output(f"\t\t{key}: {value}")
 
         if additional:
             for key, value in additional.items():
-                print(f"\t\t{key}: {value}")
+                output(f"\t\t{key}: {value}")
 
-        print()
+        output()
 
     def yaml(self):
         # UUID is used as key and does not need to be stored
@@ -89,4 +167,6 @@ class Node:
             "unicast": self.unicast,
             "count": self.count,
             "configured": self.configured,
+            "net_index": self.net_index,
+            "snapshot": self.snapshot(),
         }
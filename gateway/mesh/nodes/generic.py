@@ -1,12 +1,17 @@
+import time
 import asyncio
 import logging
 
 from mesh import Node
-from mesh.composition import Composition, Element
+from mesh.composition import Composition
+from mesh.rtt import RoundTripTimer
 
 from bluetooth_mesh import models
 
 
+logger = logging.getLogger(__name__)
+
+
 class Generic(Node):
     """
     Generic Bluetooth Mesh node
@@ -20,16 +25,85 @@ class Generic(Node):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
-        # stores the node's composition data
+        # stores the node's composition data, which is fetched only once
         self._composition = None
-        # lists all bound model
+        if self._restored.get("composition"):
+            self._composition = Composition(self._restored["composition"])
+        # lists all bound models by element
         self._bound_models = set()
-
-    def _is_model_bound(self, model):
+        # derives request timeouts for this node
+        self._rtt = RoundTripTimer(**self._restored.get("rtt", {}))
+
+    def snapshot(self):
+        snapshot = {
+            **super().snapshot(),
+            "rtt": self._rtt.yaml(),
+        }
+        if self._composition is not None:
+            snapshot["composition"] = self._composition.yaml()
+        return snapshot
+
+    def _is_model_bound(self, model, element=0):
         """
         Check if the given model is supported and bound
         """
-        return model in self._bound_models
+        return (element, model) in self._bound_models
+
+    async def query(self, getter, *args, element=0, retries=2, scale=1, **kwargs):
+        """
+        Send an acknowledged request to an element of this node
+
+        The timeout is derived from the measured round trip times of this node.
+        Requests with large responses can scale the timeout. Timed out requests
+        are retried with a doubled timeout. Only requests that succeeded on the
+        first attempt are used to update the round trip time.
+
+        Returns the result for this node.
+        """
+        timeout = self._rtt.timeout * scale
+
+        for attempt in range(retries + 1):
+            start = time.monotonic()
+            try:
+                address = self.unicast + element
+                data = await getter([address], *args, timeout=timeout, **kwargs)
+                result = data.get(address)
+            except asyncio.TimeoutError as e:
+                result = e
+
+            if not isinstance(result, (asyncio.TimeoutError, TimeoutError)):
+                if attempt == 0 and not isinstance(result, BaseException):
+                    self._rtt.update((time.monotonic() - start) / scale)
+                return result
+
+            timeout = min(timeout * 2, RoundTripTimer.MAX_TIMEOUT * scale)
+            logger.info("Request to %s timed out, retrying with %.1fs timeout", self, timeout)
+
+        return result
+
+    async def configure(self, setter, *args, retries=2, **kwargs):
+        """
+        Send an acknowledged configuration request to this node
+
+        Unlike getters, configuration requests are sent to a single destination
+        and raise on timeout. Timeouts and retries follow query.
+        """
+        timeout = self._rtt.timeout
+
+        for attempt in range(retries + 1):
+            start = time.monotonic()
+            try:
+                result = await setter(self.unicast, *args, timeout=timeout, **kwargs)
+            except asyncio.TimeoutError:
+                timeout = min(timeout * 2, RoundTripTimer.MAX_TIMEOUT)
+                logger.info("Request to %s timed out, retrying with %.1fs timeout", self, timeout)
+                continue
+
+            if attempt == 0:
+                self._rtt.update(time.monotonic() - start)
+            return result
+
+        raise asyncio.TimeoutError(f"{self} did not respond")
 
     async def fetch_composition(self):
         """
@@ -38,45 +112,99 @@ class Generic(Node):
         This data contains information about the node's capabilities.
         Use the helper functions to retrieve information.
         """
-        client = self._app.elements[0][models.ConfigClient]
-        data = await client.get_composition_data([self.unicast], net_index=0, timeout=30)
+        client = self._app.client(models.ConfigClient)
+        # composition data is segmented and takes considerably longer
+        data = await self.query(client.get_composition_data, net_index=self.net_index, scale=3)
+        if isinstance(data, BaseException):
+            raise data
+
         # TODO: multi page composition data support
-        page_zero = data.get(self.unicast, {}).get("zero")
+        page_zero = (data or {}).get("zero")
         self._composition = Composition(page_zero)
 
     async def bind(self, app):
         await super().bind(app)
 
-        # update the composition data
-        await self.fetch_composition()
+        # the composition data is kept across restarts
+        if self._composition is None:
+            await self.fetch_composition()
 
-        logging.debug(f"Node composition:\n{self._composition}")
+        logger.debug("Node composition:\n%s", self._composition)
 
-    async def bind_model(self, model):
+    async def bind_model(self, model, element=0):
         """
-        Bind the given model to the application key
+        Bind the given model of an element to the application key
 
-        If the node supports the given model, it is bound to the appliaction key
+        If the element supports the given model, it is bound to the appliaction key
         and listed within the supported models.
 
         If the node does not support the given model, the request is skipped.
         """
 
         if self._composition is None:
-            logging.info(f"No composition data for {self}")
+            logger.info("No composition data for %s", self)
             return False
 
-        element = self._composition.element(0)
-        if not element.supports(model):
-            logging.info(f"{self} does not support {model}")
+        if element >= len(self._composition.elements) or not self._composition.element(element).supports(model):
+            logger.info("%s does not support %s on element %s", self, model, element)
             return False
 
         # configure model
-        client = self._app.elements[0][models.ConfigClient]
-        await client.bind_app_key(
-            self.unicast, net_index=0, element_address=self.unicast, app_key_index=self._app.app_keys[0][0], model=model
+        client = self._app.client(models.ConfigClient)
+        await self.configure(
+            client.bind_app_key,
+            net_index=self.net_index,
+            element_address=self.unicast + element,
+            app_key_index=self.app_index,
+            model=model,
         )
-        self._bound_models.add(model)
+        self._bound_models.add((element, model))
 
-        logging.info(f"{self} bound {model}")
+        logger.info("%s bound %s on element %s", self, model, element)
         return True
+
+    async def subscribe_model(self, model, address, element=0):
+        """
+        Subscribe the given model of an element to a group address
+        """
+        client = self._app.client(models.ConfigClient)
+        await self.configure(
+            client.add_subscription,
+            net_index=self.net_index,
+            element_address=self.unicast + element,
+            subscription_address=address,
+            model=model,
+        )
+
+        logger.info("%s subscribed %s on element %s to %04x", self, model, element, address)
+
+    async def publish_model(self, model, address, element=0):
+        """
+        Configure the given model of an element to publish its state to an address
+        """
+        client = self._app.client(models.ConfigClient)
+        await self.configure(
+            client.set_publication,
+            net_index=self.net_index,
+            element_address=self.unicast + element,
+            publication_address=address,
+            app_key_index=self.app_index,
+            model=model,
+        )
+
+        logger.info("%s publishes %s on element %s to %04x", self, model, element, address)
+
+    async def bind_scene(self, group):
+        """
+        Bind the scene models of all elements and subscribe them to the scene's group address
+        """
+        for element in self.elements:
+            for model in (models.SceneServer, models.SceneSetupServer):
+                if await self.bind_model(model, element):
+                    await self.subscribe_model(model, group, element)
+
+    async def refresh(self):
+        """
+        Retrieve the current state of all bound models
+        """
+        pass
@@ -1,10 +1,15 @@
-import asyncio
 import logging
 
 from .generic import Generic
+from mesh.batch import SetBatcher
 
 from bluetooth_mesh import models
 
+from tools import traced
+
+
+logger = logging.getLogger(__name__)
+
 
 class Light(Generic):
     """
@@ -18,109 +23,230 @@ class Light(Generic):
         - LightCTLServer
             - set color temperature
 
-    For now only a single element is supported.
+    Changes are sent unacknowledged by default and assumed to succeed. With
+    the ack option, changes are acknowledged and the retained state is taken
+    from the status replies of the node.
+
+    Every element providing any of these models is a separate light,
+    addressed at the node's unicast address plus the element index.
     """
 
     OnOffProperty = "onoff"
     BrightnessProperty = "brightness"
     TemperatureProperty = "temperature"
 
+    # acknowledged changes to many lights are sent together
+    _batcher = SetBatcher()
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
-        self._features = set()
-
-    def supports(self, property):
-        return property in self._features
+        # features by element, previous snapshots only contain the first element
+        features = self._restored.get("features", [])
+        if isinstance(features, list):
+            features = {0: features}
+        self._features = {element: set(properties) for element, properties in features.items()}
+
+    @property
+    def elements(self):
+        return sorted(self._features) or [0]
+
+    def supports(self, property, element=0):
+        return property in self._features.get(element, ())
+
+    @property
+    def acknowledged(self):
+        return self.config.optional("ack", False)
+
+    def snapshot(self):
+        return {
+            **super().snapshot(),
+            "features": {element: sorted(properties) for element, properties in self._features.items()},
+        }
+
+    @traced("light.turn_on")
+    async def turn_on(self, element=0):
+        if self.acknowledged:
+            await self.set_onoff(True, element, transition_time=0.5)
+        else:
+            await self.set_onoff_unack(True, element, transition_time=0.5)
 
-    async def turn_on(self):
-        await self.set_onoff_unack(True, transition_time=0.5)
+    @traced("light.turn_off")
+    async def turn_off(self, element=0):
+        if self.acknowledged:
+            await self.set_onoff(False, element, transition_time=0.5)
+        else:
+            await self.set_onoff_unack(False, element, transition_time=0.5)
+
+    @traced("light.set_brightness")
+    async def set_brightness(self, brightness, element=0):
+        if self._is_model_bound(models.LightLightnessServer, element):
+            if self.acknowledged:
+                await self.set_lightness(brightness, element, transition_time=0.5)
+            else:
+                await self.set_lightness_unack(brightness, element, transition_time=0.5)
+        elif self._is_model_bound(models.LightCTLServer, element):
+            if self.acknowledged:
+                await self.set_ctl(brightness=brightness, element=element)
+            else:
+                await self.set_ctl_unack(brightness=brightness, element=element)
+
+    @traced("light.set_kelvin")
+    async def set_kelvin(self, temperature, element=0):
+        if self._is_model_bound(models.LightCTLServer, element):
+            if self.acknowledged:
+                await self.set_ctl(temperature, element=element)
+            else:
+                await self.set_ctl_unack(temperature, element=element)
+
+    @traced("light.set_mireds")
+    async def set_mireds(self, temperature, element=0):
+        await self.set_kelvin(1000000 // temperature, element)
 
-    async def turn_off(self):
-        await self.set_onoff_unack(False, transition_time=0.5)
+    async def bind(self, app):
+        await super().bind(app)
 
-    async def set_brightness(self, brightness):
-        if self._is_model_bound(models.LightLightnessServer):
-            await self.set_lightness_unack(brightness, transition_time=0.5)
-        elif self._is_model_bound(models.LightCTLServer):
-            await self.set_ctl_unack(brightness=brightness)
+        # bind all elements using the composition data
+        features = {}
+        for element in range(len(self._composition.elements)):
+            properties = set()
 
-    async def set_kelvin(self, temperature):
-        if self._is_model_bound(models.LightCTLServer):
-            await self.set_ctl_unack(temperature)
+            if await self.bind_model(models.GenericOnOffServer, element):
+                properties.add(Light.OnOffProperty)
 
-    async def set_mireds(self, temperature):
-        if self._is_model_bound(models.LightCTLServer):
-            await self.set_ctl_unack(1000000 // temperature)
+            if await self.bind_model(models.LightLightnessServer, element):
+                properties.add(Light.OnOffProperty)
+                properties.add(Light.BrightnessProperty)
 
-    async def bind(self, app):
-        await super().bind(app)
+            if await self.bind_model(models.LightCTLServer, element):
+                properties.add(Light.TemperatureProperty)
+                properties.add(Light.BrightnessProperty)
 
-        if await self.bind_model(models.GenericOnOffServer):
-            self._features.add(Light.OnOffProperty)
-            await self.get_onoff()
+            if properties:
+                features[element] = properties
 
-        if await self.bind_model(models.LightLightnessServer):
-            self._features.add(Light.OnOffProperty)
-            self._features.add(Light.BrightnessProperty)
-            await self.get_lightness()
+        self._features = features
 
-        if await self.bind_model(models.LightCTLServer):
-            self._features.add(Light.TemperatureProperty)
-            self._features.add(Light.BrightnessProperty)
-            await self.get_ctl()
+        await self.refresh()
 
-    async def set_onoff_unack(self, onoff, **kwargs):
-        self.notify(Light.OnOffProperty, onoff)
+    async def refresh(self):
+        for element in self.elements:
+            await self._refresh_element(element)
 
-        client = self._app.elements[0][models.GenericOnOffClient]
-        await client.set_onoff_unack(self.unicast, self._app.app_keys[0][0], onoff, **kwargs)
+    async def _refresh_element(self, element):
+        if self._is_model_bound(models.GenericOnOffServer, element):
+            await self.get_onoff(element)
+        if self._is_model_bound(models.LightLightnessServer, element):
+            await self.get_lightness(element)
+        if self._is_model_bound(models.LightCTLServer, element):
+            await self.get_ctl(element)
 
-    async def get_onoff(self):
-        client = self._app.elements[0][models.GenericOnOffClient]
-        state = await client.get_light_status([self.unicast], self._app.app_keys[0][0])
+    async def _retained_ctl(self, element):
+        # values not passed to CTL messages are taken from the retained state
+        if self.stale(element):
+            await self._refresh_element(element)
 
-        result = state[self.unicast]
-        if result is None:
-            logging.warn(f"Received invalid result {state}")
-        elif not isinstance(result, BaseException):
-            self.notify(Light.OnOffProperty, result["present_onoff"])
+    @traced("light.set_onoff_unack")
+    async def set_onoff_unack(self, onoff, element=0, **kwargs):
+        self.notify(Light.OnOffProperty, onoff, element)
 
-    async def set_lightness_unack(self, lightness, **kwargs):
-        self.notify(Light.BrightnessProperty, lightness)
+        client = self._app.client(models.GenericOnOffClient)
+        await client.set_onoff_unack(self.unicast + element, self.app_index, onoff, **kwargs)
 
-        client = self._app.elements[0][models.LightLightnessClient]
-        await client.set_lightness_unack(self.unicast, self._app.app_keys[0][0], lightness, **kwargs)
+    @traced("light.set_onoff")
+    async def set_onoff(self, onoff, element=0, **kwargs):
+        client = self._app.client(models.GenericOnOffClient)
+        result = await Light._batcher.request(
+            client, "set_onoff", self.unicast + element, self.app_index, onoff, rtt=self._rtt, **kwargs
+        )
+        if result is None:
+            logger.warning("%s did not acknowledge on/off", self)
+        else:
+            self.notify(Light.OnOffProperty, result["present_onoff"], element)
 
-    async def get_lightness(self):
-        client = self._app.elements[0][models.LightLightnessClient]
-        state = await client.get_lightness([self.unicast], self._app.app_keys[0][0])
+    async def get_onoff(self, element=0):
+        client = self._app.client(models.GenericOnOffClient)
+        result = await self.query(client.get_light_status, self.app_index, element=element)
+        if result is None:
+            logger.warning("Received invalid result from %s", self)
+        elif not isinstance(result, BaseException):
+            self.notify(Light.OnOffProperty, result["present_onoff"], element)
+
+    @traced("light.set_lightness_unack")
+    async def set_lightness_unack(self, lightness, element=0, **kwargs):
+        self.notify(Light.BrightnessProperty, lightness, element)
+
+        client = self._app.client(models.LightLightnessClient)
+        await client.set_lightness_unack(self.unicast + element, self.app_index, lightness, **kwargs)
+
+    @traced("light.set_lightness")
+    async def set_lightness(self, lightness, element=0, **kwargs):
+        client = self._app.client(models.LightLightnessClient)
+        result = await Light._batcher.request(
+            client,
+            "set_lightness",
+            self.unicast + element,
+            self.app_index,
+            lightness,
+            rtt=self._rtt,
+            **kwargs,
+        )
+        if result is None:
+            logger.warning("%s did not acknowledge lightness", self)
+        else:
+            self.notify(Light.BrightnessProperty, result["present_lightness"], element)
 
-        result = state[self.unicast]
+    async def get_lightness(self, element=0):
+        client = self._app.client(models.LightLightnessClient)
+        result = await self.query(client.get_lightness, self.app_index, element=element)
         if result is None:
-            logging.warn(f"Received invalid result {state}")
+            logger.warning("Received invalid result from %s", self)
         elif not isinstance(result, BaseException):
-            self.notify(Light.BrightnessProperty, result["present_lightness"])
+            self.notify(Light.BrightnessProperty, result["present_lightness"], element)
 
-    async def set_ctl_unack(self, temperature=None, brightness=None, **kwargs):
+    @traced("light.set_ctl_unack")
+    async def set_ctl_unack(self, temperature=None, brightness=None, element=0, **kwargs):
+        await self._retained_ctl(element)
         if temperature:
-            self.notify(Light.TemperatureProperty, temperature)
+            self.notify(Light.TemperatureProperty, temperature, element)
         else:
-            temperature = self.retained(Light.TemperatureProperty, 255)
+            temperature = self.retained(Light.TemperatureProperty, 255, element)
         if brightness:
-            self.notify(Light.BrightnessProperty, temperature)
+            self.notify(Light.BrightnessProperty, temperature, element)
         else:
-            brightness = self.retained(Light.BrightnessProperty, 100)
-
-        client = self._app.elements[0][models.LightCTLClient]
-        await client.set_ctl_unack(self.unicast, self._app.app_keys[0][0], temperature, brightness, **kwargs)
-
-    async def get_ctl(self):
-        client = self._app.elements[0][models.LightCTLClient]
-        state = await client.get_ctl([self.unicast], self._app.app_keys[0][0])
+            brightness = self.retained(Light.BrightnessProperty, 100, element)
+
+        client = self._app.client(models.LightCTLClient)
+        await client.set_ctl_unack(self.unicast + element, self.app_index, temperature, brightness, **kwargs)
+
+    @traced("light.set_ctl")
+    async def set_ctl(self, temperature=None, brightness=None, element=0, **kwargs):
+        await self._retained_ctl(element)
+        temperature = temperature or self.retained(Light.TemperatureProperty, 255, element)
+        brightness = brightness or self.retained(Light.BrightnessProperty, 100, element)
+
+        client = self._app.client(models.LightCTLClient)
+        result = await Light._batcher.request(
+            client,
+            "set_ctl",
+            self.unicast + element,
+            self.app_index,
+            temperature,
+            brightness,
+            rtt=self._rtt,
+            **kwargs,
+        )
+        if result is None:
+            logger.warning("%s did not acknowledge CTL", self)
+        else:
+            self.notify(Light.TemperatureProperty, result["present_ctl_temperature"], element)
+            self.notify(Light.BrightnessProperty, result["present_ctl_lightness"], element)
 
-        result = state[self.unicast]
+    async def get_ctl(self, element=0):
+        client = self._app.client(models.LightCTLClient)
+        result = await self.query(client.get_ctl, self.app_index, element=element)
         if result is None:
-            logging.warn(f"Received invalid result {state}")
+            logger.warning("Received invalid result from %s", self)
         elif not isinstance(result, BaseException):
-            print(result)
+            self.notify(Light.TemperatureProperty, result["present_ctl_temperature"], element)
+            self.notify(Light.BrightnessProperty, result["present_ctl_lightness"], element)
@@ -0,0 +1,123 @@
+import asyncio
+import logging
+
+from bluetooth_mesh import models
+from bluetooth_mesh.messages.sensor import SensorOpcode
+
+from .generic import Generic
+
+
+logger = logging.getLogger(__name__)
+
+
+class Sensor(Generic):
+    """
+    Generic interface for sensor nodes
+
+    Receives sensor status messages from the SensorServer and notifies
+    subscribers about every single reading. Properties are named after
+    their Bluetooth Mesh device property ID. Additional names can be
+    configured using the properties option.
+
+    The SensorServer is configured to publish its readings to the gateway.
+    Nodes that do not publish their readings can be polled.
+    """
+
+    PROPERTIES = {
+        0x0042: "motion",
+        0x004C: "people_count",
+        0x004E: "illuminance",
+        0x004F: "temperature",
+        0x0052: "power",
+        0x006A: "energy",
+    }
+
+    # sensor nodes by unicast address, used to dispatch status messages
+    _sensors = {}
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        self._properties = {**Sensor.PROPERTIES, **self.config.optional("properties", {})}
+        self._poll_task = None
+
+    @staticmethod
+    def _sensor_status(source, app_index, destination, message):
+        sensor = Sensor._sensors.get(source)
+        if sensor is not None:
+            sensor._receive(message)
+
+    def _receive(self, message):
+        """
+        Notify about all readings contained in a sensor status message
+        """
+        for entry in message.get("sensor_status", []):
+            property_id = entry.get("sensor_setting_property_id", entry.get("property_id"))
+            value = self._value(entry.get("sensor_data", entry.get("value")))
+
+            if property_id is None or value is None:
+                logger.debug("Skipping sensor reading %s from %s", entry, self)
+                continue
+
+            self.notify(self._properties.get(property_id, f"property_{property_id:04x}"), value)
+
+    def _value(self, data):
+        """
+        Get the numeric value of a parsed sensor reading
+        """
+        if isinstance(data, dict):
+            for value in data.values():
+                value = self._value(value)
+                if value is not None:
+                    return value
+            return None
+
+        if isinstance(data, bool):
+            return int(data)
+        if isinstance(data, (int, float)):
+            return data
+        return None
+
+    async def bind(self, app):
+        await super().bind(app)
+
+        if await self.bind_model(models.SensorServer):
+            Sensor._sensors[self.unicast] = self
+
+            client = self._app.client(models.SensorClient)
+            client.app_message_callbacks[SensorOpcode.SENSOR_STATUS].add(Sensor._sensor_status)
+
+            await self.publish_model(models.SensorServer, self._app.address)
+            await self.refresh()
+
+            interval = self.config.optional("poll")
+            if interval and self._poll_task is None:
+                self._poll_task = asyncio.create_task(self._poll(interval))
+
+    def stop(self):
+        if self._poll_task is not None:
+            self._poll_task.cancel()
+            self._poll_task = None
+
+        if Sensor._sensors.get(self.unicast) is self:
+            del Sensor._sensors[self.unicast]
+
+    async def _poll(self, interval):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.refresh()
+            except:
+                logger.exception("Failed to poll %s", self)
+
+    async def refresh(self):
+        if self._is_model_bound(models.SensorServer):
+            await self.get_sensor()
+
+    async def get_sensor(self):
+        client = self._app.client(models.SensorClient)
+        result = await self.query(client.get_sensor, self.app_index)
+        if result is None:
+            logger.warning("Received invalid result from %s", self)
+        elif not isinstance(result, BaseException):
+            self._receive(result)
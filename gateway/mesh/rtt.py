@@ -0,0 +1,49 @@
+class RoundTripTimer:
+    """
+    Derives request timeouts from measured round trip times
+
+    Keeps a smoothed round trip time and its variance, like the retransmission
+    timer of TCP (RFC 6298). Nodes close to the gateway get short timeouts,
+    while nodes behind several relays get longer ones.
+    """
+
+    ALPHA = 1 / 8
+    BETA = 1 / 4
+    K = 4
+
+    INITIAL_TIMEOUT = 10.0
+    MIN_TIMEOUT = 1.0
+    MAX_TIMEOUT = 60.0
+
+    def __init__(self, srtt=None, rttvar=None):
+        self.srtt = srtt
+        self.rttvar = rttvar
+
+    @property
+    def timeout(self):
+        if self.srtt is None:
+            return RoundTripTimer.INITIAL_TIMEOUT
+
+        timeout = self.srtt + RoundTripTimer.K * self.rttvar
+        return min(max(timeout, RoundTripTimer.MIN_TIMEOUT), RoundTripTimer.MAX_TIMEOUT)
+
+    def update(self, rtt):
+        """
+        Add a new round trip time measurement
+        """
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+            return
+
+        self.rttvar = (1 - RoundTripTimer.BETA) * self.rttvar + RoundTripTimer.BETA * abs(self.srtt - rtt)
+        self.srtt = (1 - RoundTripTimer.ALPHA) * self.srtt + RoundTripTimer.ALPHA * rtt
+
+    def yaml(self):
+        if self.srtt is None:
+            return {}
+
+        return {
+            "srtt": round(self.srtt, 4),
+            "rttvar": round(self.rttvar, 4),
+        }
@@ -0,0 +1,121 @@
+import asyncio
+import logging
+import weakref
+
+from bluetooth_mesh import models
+
+from tools import Config
+
+
+logger = logging.getLogger(__name__)
+
+
+class Scene:
+    """
+    Bluetooth Mesh scene spanning multiple nodes
+
+    All member nodes subscribe their scene models to the scene's group address.
+    This allows to store and recall the scene with a single group message.
+
+    Provides the same interface as Node where required by MQTT bridges.
+    """
+
+    # scenes are a single entity
+    elements = [0]
+
+    def __init__(self, id, info, nodes):
+        self.config = Config(config={"id": id, **info})
+        self.number = self.config.require("number")
+        self.group = self.config.require("group")
+
+        self._app = None
+        self._nodes = nodes
+        # member instances that already listen for this scene
+        self._bound = weakref.WeakSet()
+
+        # event system for scene initialization
+        self.ready = asyncio.Event()
+
+    def __str__(self):
+        return f"{self.config.require('id')} (scene {self.number}, {self.group:04x})"
+
+    @property
+    def members(self):
+        """
+        Current instances of all member nodes
+        """
+        members = self.config.optional("nodes", [])
+        return [node for node in self._nodes.all() if node.config.optional("id") in members]
+
+    @property
+    def app_index(self):
+        """
+        Application key of the scene, defaults to the key shared by all members
+        """
+        app_index = self.config.optional("app_index")
+        if app_index is None:
+            indexes = {node.app_index for node in self.members}
+            app_index = indexes.pop() if len(indexes) == 1 else 0
+        return app_index
+
+    async def bind(self, app):
+        """
+        Configure all member nodes to listen for scene messages
+
+        Only members that are already ready are configured here. All other
+        members are configured by the gateway once they become ready.
+        """
+        self._app = app
+
+        for node in self.members:
+            if node.ready.is_set():
+                await self.bind_member(node)
+
+    async def bind_member(self, node):
+        """
+        Configure a member node that became ready to listen for scene messages
+        """
+        if self._app is None or node in self._bound or node not in self.members:
+            return
+        self._bound.add(node)
+
+        if node.app_index != self.app_index:
+            logger.warning("%s uses application key %s, but %s uses %s", node, node.app_index, self, self.app_index)
+
+        await node.bind_scene(self.group)
+
+    def subscribe(self, subscriber, resend=True):
+        """
+        Scenes do not have any state
+        """
+        pass
+
+    def retained_items(self, element=0):
+        return []
+
+    def stale(self, element=None, property=None):
+        return False
+
+    async def store(self):
+        """
+        Store the current state of all members as this scene
+        """
+        logger.info("Storing scene %s", self)
+
+        client = self._app.client(models.SceneClient)
+        await client.store_scene_unack(self.group, self.app_index, self.number)
+
+    async def recall(self):
+        """
+        Recall this scene on all members
+        """
+        logger.info("Recalling scene %s", self)
+
+        transition_time = self.config.optional("transition", 0.5)
+
+        client = self._app.client(models.SceneClient)
+        await client.recall_scene_unack(self.group, self.app_index, self.number, transition_time=transition_time)
+
+        # the stored state is unknown, members refresh it when it is needed
+        for node in self.members:
+            node.invalidate()
@@ -1,3 +1,21 @@
+import io
+import argparse
+
+
+class _CommandParser(argparse.ArgumentParser):
+    """
+    Argument parser, that writes usage and help to the given stream
+    """
+
+    def __init__(self, *args, output, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._output = output
+
+    def _print_message(self, message, file=None):
+        if message:
+            self._output.write(message)
+
+
 class Module:
     """
     Base class for application modules
@@ -6,6 +24,9 @@ class Module:
     like i.e. a command line interface or an HTTP or MQTT interface.
     """
 
+    # output of the running command, the command line if not set
+    _output = None
+
     def __init__(self):
         pass
 
@@ -18,6 +39,12 @@ class Module:
         self.store = store
         self.config = config
 
+    def print(self, *args, **kwargs):
+        """
+        Print to the output of the running command
+        """
+        print(*args, file=self._output, **kwargs)
+
     def setup_cli(self, parser):
         """
         Setup argparse sub parser for direct CLI usage
@@ -29,3 +56,32 @@ class Module:
         Run from CLI
         """
         pass
+
+    async def handle_command(self, name, argv):
+        """
+        Run from a list of CLI arguments within the running application
+
+        Returns everything the module would print to the command line.
+        """
+        output = io.StringIO()
+
+        parser = _CommandParser(prog=name, exit_on_error=False, output=output)
+        self.setup_cli(parser)
+
+        try:
+            args = parser.parse_args(argv)
+        except argparse.ArgumentError as e:
+            parser.print_usage()
+            output.write(f"{name}: error: {e}\n")
+            return output.getvalue()
+        except SystemExit:
+            # usage, help or errors are already written
+            return output.getvalue()
+
+        self._output = output
+        try:
+            await self.handle_cli(args)
+        finally:
+            self._output = None
+
+        return output.getvalue()
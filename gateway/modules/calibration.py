@@ -0,0 +1,184 @@
+import time
+import asyncio
+import logging
+import statistics
+
+from uuid import UUID
+
+from bluetooth_mesh import models
+
+from . import Module
+
+
+logger = logging.getLogger(__name__)
+
+
+class CalibrationModule(Module):
+    """
+    Network and relay retransmit calibration
+
+    Sends test traffic to a node with several retransmit settings, cheapest first.
+    Delivery ratio and latency are measured from acknowledged gets, that are sent
+    exactly once. The cheapest setting that meets the target delivery ratio is
+    stored per node and applied.
+    """
+
+    # network transmit counts to try
+    NETWORK_COUNTS = [0, 1, 2, 3]
+    # relay retransmit counts to try for relay nodes
+    RELAY_COUNTS = [0, 1, 2, 3]
+    # interval between retransmissions in milliseconds
+    INTERVAL = 20
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+    def setup_cli(self, parser):
+        parser.add_argument("task", choices=["run", "show"])
+        parser.add_argument("uuid", nargs="?", default=None)
+        parser.add_argument("--all", action="store_true", help="calibrate all nodes")
+        parser.add_argument("--target", type=float, default=0.95, help="required delivery ratio")
+        parser.add_argument("--probes", type=int, default=20, help="test messages per setting")
+        parser.add_argument("--timeout", type=float, default=2.0, help="timeout per test message")
+
+    async def handle_cli(self, args):
+        if args.task == "show":
+            self.print_settings()
+            return
+
+        if args.all:
+            nodes = [node for node in self.app.nodes.all() if node.configured]
+        else:
+            try:
+                node = self.app.nodes.get(UUID(args.uuid))
+            except:
+                self.print("Invalid uuid")
+                return
+            if node is None:
+                self.print("Unknown node")
+                return
+            nodes = [node]
+
+        for node in nodes:
+            await self._calibrate(node, args.target, args.probes, args.timeout)
+
+        self.print_settings()
+
+    def settings(self, node):
+        """
+        Get the calibrated settings of a node, if available
+        """
+        return self.store.get(str(node.uuid), None)
+
+    def print_settings(self):
+        self.print("\nCalibrated settings:")
+        for node in self.app.nodes.all():
+            settings = self.settings(node)
+            if settings:
+                self.print(f"\t{node}: {settings}")
+
+    def _is_relay(self, node):
+        relay = node.config.optional("relay", False)
+        if relay == "auto":
+            # follow the relay plan of the topology module
+            return self.app.modules["topo"].is_relay(node)
+        return relay is True
+
+    def _candidates(self, node):
+        """
+        List all settings ordered by their airtime cost
+        """
+        relay_counts = CalibrationModule.RELAY_COUNTS if self._is_relay(node) else [None]
+        candidates = [
+            (network_count, relay_count)
+            for network_count in CalibrationModule.NETWORK_COUNTS
+            for relay_count in relay_counts
+        ]
+        return sorted(candidates, key=lambda candidate: candidate[0] + (candidate[1] or 0))
+
+    async def apply(self, node, network_count, relay_count=None):
+        """
+        Apply retransmit settings to a node
+        """
+        client = self.app.client(models.ConfigClient)
+
+        await client.set_network_transmission(
+            node.unicast, net_index=node.net_index, interval=CalibrationModule.INTERVAL, count=network_count
+        )
+        if relay_count is not None:
+            await client.set_relay(
+                node.unicast,
+                net_index=node.net_index,
+                relay=True,
+                retransmit_count=relay_count,
+                retransmit_interval=CalibrationModule.INTERVAL,
+            )
+
+    async def _probe(self, node, probes, timeout):
+        """
+        Measure delivery ratio and latency of single shot acknowledged gets
+        """
+        client = self.app.client(models.ConfigClient)
+        latencies = []
+
+        for _ in range(probes):
+            start = time.monotonic()
+            try:
+                # send exactly once by using the timeout as send interval
+                data = await client.get_default_ttl(
+                    [node.unicast], net_index=node.net_index, send_interval=timeout, timeout=timeout
+                )
+                result = data.get(node.unicast)
+            except asyncio.TimeoutError as e:
+                result = e
+
+            if result is not None and not isinstance(result, BaseException):
+                latencies.append(time.monotonic() - start)
+
+        return len(latencies) / probes, statistics.median(latencies) if latencies else None
+
+    def _store(self, node, network_count, relay_count, delivery, latency):
+        self.store.set(
+            str(node.uuid),
+            {
+                "network_count": network_count,
+                "relay_count": relay_count,
+                "delivery": round(delivery, 3),
+                "latency": round(latency, 4) if latency else None,
+            },
+        )
+        self.store.persist()
+
+    async def _calibrate(self, node, target, probes, timeout):
+        logger.info("Calibrating %s...", node)
+
+        # most reliable setting so far, the cheapest one wins on equal delivery
+        best = None
+
+        for network_count, relay_count in self._candidates(node):
+            await self.apply(node, network_count, relay_count)
+            delivery, latency = await self._probe(node, probes, timeout)
+
+            logger.info(
+                "%s: network count %s, relay count %s: delivery %.2f, latency %s",
+                node,
+                network_count,
+                relay_count,
+                delivery,
+                latency,
+            )
+
+            if delivery >= target:
+                self._store(node, network_count, relay_count, delivery, latency)
+                return
+
+            if best is None or delivery > best[2]:
+                best = (network_count, relay_count, delivery, latency)
+
+        if best is None:
+            return
+
+        # keep the most reliable setting if the target can not be met
+        logger.warning("%s does not meet the target delivery ratio %.2f", node, target)
+        await self.apply(node, best[0], best[1])
+        self._store(node, *best)
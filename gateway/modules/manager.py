@@ -1,3 +1,4 @@
+import json
 import asyncio
 import logging
 
@@ -8,56 +9,148 @@ from bluetooth_mesh import models
 from . import Module
 
 
+logger = logging.getLogger(__name__)
+
+
 class ManagerModule(Module):
     """
     Node managment functionality
+
+    Get operations can target a single node or many nodes at once. Multiple nodes
+    are queried in batches, with a bounded number of batches in flight.
     """
 
+    # config client getters by field name
+    FIELDS = {
+        "ttl": "default_ttl",
+        "composition": "composition_data",
+    }
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
-        self._get_result = None
-
     def initialize(self, app, store, config):
         super().initialize(app, store, config)
 
     def setup_cli(self, parser):
         parser.add_argument("operation")
         parser.add_argument("field")
-        parser.add_argument("uuid")
+        parser.add_argument("uuid", nargs="?", default=None)
+        parser.add_argument("--all", action="store_true", help="target all nodes")
+        parser.add_argument("--type", default=None, help="target all nodes of the given type")
+        parser.add_argument("--area", default=None, help="target all nodes of the given area")
+        parser.add_argument("--json", action="store_true", help="print results as JSON")
+        parser.add_argument("--batch", type=int, default=16, help="nodes per request")
+        parser.add_argument("--concurrency", type=int, default=4, help="requests in flight")
+
+    def _select(self, args):
+        """
+        Get all nodes targeted by the given arguments
+        """
+        if args.all or args.type or args.area:
+            return [
+                node
+                for node in self.app.nodes.all()
+                if (args.type is None or node.type == args.type)
+                and (args.area is None or node.config.optional("area") == args.area)
+            ]
 
-    async def handle_cli(self, args):
         try:
             uuid = UUID(args.uuid)
         except:
-            print("Invalid uuid")
-            return
+            self.print("Invalid uuid")
+            return None
 
         node = self.app.nodes.get(uuid)
         if node is None:
-            print("Unknown node")
-            return
+            self.print("Unknown node")
+            return None
 
-        if args.operation == "get":
-            if args.field == "ttl":
-                await self._get(uuid, node.unicast, "default_ttl")
-            if args.field == "composition":
-                await self._get(uuid, node.unicast, "composition_data")
+        return [node]
 
-            print("\nGet returned:")
-            node.print_info(self._get_result)
+    async def handle_cli(self, args):
+        if args.operation == "set":
             return
 
-        if args.operation == "set":
+        if args.operation != "get":
+            self.print(f"Unknown operation {args.operation}")
             return
 
-        print(f"Unknown operation {args.operation}")
+        if args.field not in ManagerModule.FIELDS:
+            self.print(f"Unknown field {args.field}")
+            return
 
-    async def _get(self, uuid, address, getter):
-        logging.info(f"Get {getter} from {uuid} ({address})...")
+        nodes = self._select(args)
+        if nodes is None:
+            return
 
-        client = self.app.elements[0][models.ConfigClient]
+        results = await self._get(nodes, ManagerModule.FIELDS[args.field], args.batch, args.concurrency)
+
+        if args.json:
+            self._print_json(args.field, results)
+        elif len(nodes) == 1 and args.uuid:
+            self.print("\nGet returned:")
+            nodes[0].print_info(results[nodes[0]], output=self.print)
+        else:
+            self._print_table(args.field, results)
+
+    def _print_json(self, field, results):
+        output = {
+            str(node.uuid): {
+                "id": node.config.optional("id"),
+                "unicast": node.unicast,
+                field: result,
+            }
+            for node, result in results.items()
+        }
+        self.print(json.dumps(output, indent=2, default=str))
+
+    def _print_table(self, field, results):
+        rows = [
+            (str(node.config.optional("id", "-")), str(node.uuid), f"{node.unicast:04x}", str(result))
+            for node, result in results.items()
+        ]
+        header = ("id", "uuid", "unicast", field)
+        widths = [max(len(row[column]) for row in [header, *rows]) for column in range(3)]
+
+        self.print()
+        for row in [header, *rows]:
+            self.print("  ".join([*(value.ljust(width) for value, width in zip(row, widths)), row[3]]))
+
+    async def _get(self, nodes, getter, batch_size, concurrency):
+        """
+        Query all nodes in batches
+
+        Every batch is sent as a single request to the config client.
+        """
+        client = self.app.client(models.ConfigClient)
         getter = getattr(client, f"get_{getter}")
-        data = await getter([address], net_index=0)
-
-        self._get_result = data[address]
+        semaphore = asyncio.Semaphore(concurrency)
+        results = {}
+
+        # requests are sent per subnet
+        subnets = {}
+        for node in nodes:
+            subnets.setdefault(node.net_index, []).append(node)
+
+        async def get_batch(net_index, batch):
+            async with semaphore:
+                logger.info("Get %s from %d node(s)...", getter.__name__, len(batch))
+                try:
+                    data = await getter([node.unicast for node in batch], net_index=net_index)
+                except Exception as e:
+                    data = {node.unicast: e for node in batch}
+
+            for node in batch:
+                results[node] = data.get(node.unicast)
+
+        await asyncio.gather(
+            *(
+                get_batch(net_index, subnet[index : index + batch_size])
+                for net_index, subnet in subnets.items()
+                for index in range(0, len(subnet), batch_size)
+            )
+        )
+
+        # keep the order of the selected nodes
+        return {node: results[node] for node in nodes}
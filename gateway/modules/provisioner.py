@@ -5,9 +5,14 @@ from uuid import UUID
 
 from bluetooth_mesh import models
 
+from tools import Config
+
 from . import Module
 
 
+logger = logging.getLogger(__name__)
+
+
 class ProvisionerModule(Module):
     """
     Provide provisioning functionality
@@ -17,12 +22,14 @@ class ProvisionerModule(Module):
         super().__init__(*args, **kwargs)
 
         self.provisioning_done = asyncio.Event()
+        # subnet for the node that is currently provisioned
+        self._net_index = 0
 
     def initialize(self, app, store, config):
         super().initialize(app, store, config)
 
         # ensure new devices are provisioned correctly
-        self._base_address = self.store.get("base_address", 4)
+        self._base_address = self.store.get("base_address", app.shard.address_range[0] + 3)
         self.store.persist()
 
     def setup_cli(self, parser):
@@ -45,8 +52,10 @@ class ProvisionerModule(Module):
 
         # provision nodes from configuration
         if args.task == "add" and args.uuid is None:
-            for _, info in self.app._config.require("mesh").items():
+            for id, info in self.app._config.require("mesh").items():
                 uuid = UUID(info["uuid"])
+                if not self.app.shard.owns(id, Config(config=info)):
+                    continue
                 if not self.app.nodes.has(uuid):
                     await self._provision(uuid)
 
@@ -65,7 +74,7 @@ class ProvisionerModule(Module):
         try:
             uuid = UUID(args.uuid)
         except:
-            print("Invalid uuid")
+            self.print("Invalid uuid")
             return
 
         if args.task == "add":
@@ -75,7 +84,7 @@ class ProvisionerModule(Module):
 
         node = self.app.nodes.get(uuid)
         if node is None:
-            print("Unknown node")
+            self.print("Unknown node")
             return
 
         if args.task == "config":
@@ -87,16 +96,16 @@ class ProvisionerModule(Module):
             self.print_node_list()
             return
 
-        print(f"Unknown task {args.task}")
+        self.print(f"Unknown task {args.task}")
 
     def print_node_list(self):
         """
         Print user friendly node list
         """
 
-        print(f"\nMesh contains {len(self.app.nodes)} node(s):")
+        self.print(f"\nMesh contains {len(self.app.nodes)} node(s):")
         for node in self.app.nodes.all():
-            node.print_info()
+            node.print_info(output=self.print)
 
     def _request_prov_data(self, count):
         """
@@ -109,9 +118,12 @@ class ProvisionerModule(Module):
             :param unet_index: Subnet index of the net_key
             :param uunicast: Primary Unicast address of the new node
         """
-        logging.info(f"Provisioning {count} new address(es)")
+        logger.info("Provisioning %s new address(es)", count)
 
-        prov_data = [0, self._base_address]
+        if self._base_address + count - 1 > self.app.shard.address_range[1]:
+            raise Exception(f"No unicast addresses left for shard {self.app.shard}")
+
+        prov_data = [self._net_index, self._base_address]
         self._base_address += count
 
         self.store.set("base_address", self._base_address)
@@ -136,11 +148,12 @@ class ProvisionerModule(Module):
                 "type": "generic",
                 "unicast": unicast,
                 "count": count,
+                "net_index": self._net_index,
             },
         )
         self.app.nodes.persist()
 
-        logging.info(f"Provisioned {_uuid} as {unicast} ({count})")
+        logger.info("Provisioned %s as %s (%s)", _uuid, unicast, count)
         self.provisioning_done.set()
 
     def _add_node_failed(self, uuid, reason):
@@ -155,53 +168,65 @@ class ProvisionerModule(Module):
         """
         _uuid = UUID(bytes=uuid)
 
-        logging.error(f"Failed to provision {_uuid}:\n{reason}")
+        logger.error("Failed to provision %s:\n%s", _uuid, reason)
         self.provisioning_done.set()
 
     async def _provision(self, uuid):
-        logging.info(f"Provisioning node {uuid}...")
+        logger.info("Provisioning node %s...", uuid)
 
-        # provision new node
+        # provision new node into the subnet of its area
+        self._net_index = self.config.node_config(uuid).optional("net_index", 0)
         self.provisioning_done.clear()
         await self.app.management_interface.add_node(uuid)
         await self.provisioning_done.wait()
 
     async def _configure(self, node):
-        logging.info(f"Configuring node {node}...")
+        logger.info("Configuring node %s...", node)
 
-        client = self.app.elements[0][models.ConfigClient]
+        client = self.app.client(models.ConfigClient)
+        app_key = self.app.app_key(node.app_index)
+
+        # move node to the subnet of its area
+        if app_key[1] != node.net_index:
+            await client.add_net_key(
+                node.unicast,
+                net_index=node.net_index,
+                net_key_index=app_key[1],
+                net_key=self.app.net_keys[app_key[1]],
+            )
+            node.net_index = app_key[1]
 
         # add application key
         try:
-            status = await client.add_app_key(
+            await client.add_app_key(
                 node.unicast,
-                net_index=0,
-                app_key_index=self.app.app_keys[0][0],
-                net_key_index=self.app.app_keys[0][1],
-                app_key=self.app.app_keys[0][2],
+                net_index=node.net_index,
+                app_key_index=app_key[0],
+                net_key_index=app_key[1],
+                app_key=app_key[2],
             )
         except:
-            logging.exception(f"Failed to add app key for node {node}")
+            logger.exception("Failed to add app key for node %s", node)
 
-            status = await client.delete_app_key(
-                node.unicast, net_index=0, app_key_index=self.app.app_keys[0][0], net_key_index=self.app.app_keys[0][1]
+            await client.delete_app_key(
+                node.unicast, net_index=node.net_index, app_key_index=app_key[0], net_key_index=app_key[1]
             )
-            status = await client.add_app_key(
+            await client.add_app_key(
                 node.unicast,
-                net_index=0,
-                app_key_index=self.app.app_keys[0][0],
-                net_key_index=self.app.app_keys[0][1],
-                app_key=self.app.app_keys[0][2],
+                net_index=node.net_index,
+                app_key_index=app_key[0],
+                net_key_index=app_key[1],
+                app_key=app_key[2],
             )
 
-        # update friend state
-        if node.config.optional("relay", False):
-            status = await client.set_relay(
-                node.unicast,
-                net_index=0,
-                relay=True,
-                retransmit_count=2,
-            )
+        # update relay state
+        if node.config.optional("relay", False) is not False:
+            await self._set_relay(node)
+
+        # apply calibrated retransmit settings
+        settings = self.app.modules["calib"].settings(node)
+        if settings:
+            await self.app.modules["calib"].apply(node, settings["network_count"])
 
         # try to set node type from Home Assistant
         node.type = node.config.optional("type", node.type)
@@ -209,12 +234,36 @@ class ProvisionerModule(Module):
         node.configured = True
         self.app.nodes.persist()
 
+        await self.app.update_node(node.uuid)
+
+    async def _set_relay(self, node):
+        logger.info("Setting relay state of %s...", node)
+
+        client = self.app.client(models.ConfigClient)
+
+        relay = node.config.optional("relay", False)
+        if relay == "auto":
+            relay = self.app.modules["topo"].is_relay(node)
+
+        # prefer calibrated retransmit settings
+        settings = self.app.modules["calib"].settings(node) or {}
+        retransmit_count = settings.get("relay_count")
+
+        await client.set_relay(
+            node.unicast,
+            net_index=node.net_index,
+            relay=relay,
+            retransmit_count=2 if retransmit_count is None else retransmit_count,
+        )
+
     async def _reset(self, node):
-        logging.info(f"Resetting node {node}...")
+        logger.info("Resetting node %s...", node)
 
-        client = self.app.elements[0][models.ConfigClient]
+        client = self.app.client(models.ConfigClient)
 
-        await client.node_reset(node.unicast, net_index=0)
+        await client.node_reset(node.unicast, net_index=node.net_index)
 
         self.app.nodes.delete(str(node.uuid))
         self.app.nodes.persist()
+
+        await self.app.remove_node(node)
@@ -6,6 +6,9 @@ from uuid import UUID
 from . import Module
 
 
+logger = logging.getLogger(__name__)
+
+
 class ScannerModule(Module):
     """
     Handle all scan related tasks
@@ -26,20 +29,20 @@ class ScannerModule(Module):
         try:
             uuid = UUID(bytes=data[:16])
             self._unprovisioned.add(uuid)
-            logging.info(f"Found unprovisioned node: {uuid}")
+            logger.info("Found unprovisioned node: %s", uuid)
         except:
-            logging.exception("Failed to retrieve UUID")
+            logger.exception("Failed to retrieve UUID")
 
     async def handle_cli(self, args):
         await self.scan()
 
         # print user friendly results
-        print(f"\nFound {len(self._unprovisioned)} nodes:")
+        self.print(f"\nFound {len(self._unprovisioned)} nodes:")
         for uuid in self._unprovisioned:
-            print(f"\t{uuid}")
+            self.print(f"\t{uuid}")
 
     async def scan(self):
-        logging.info("Scanning for unprovisioned devices...")
+        logger.info("Scanning for unprovisioned devices...")
 
         await self.app.management_interface.unprovisioned_scan(seconds=10)
         await asyncio.sleep(10.0)
@@ -0,0 +1,270 @@
+import asyncio
+import logging
+
+from bluetooth_mesh import models
+
+from . import Module
+
+
+logger = logging.getLogger(__name__)
+
+
+def components(graph):
+    """
+    Get all connected components of an undirected graph
+    """
+    remaining = set(graph)
+
+    while remaining:
+        component = set()
+        pending = [remaining.pop()]
+        while pending:
+            node = pending.pop()
+            component.add(node)
+            pending.extend(graph[node] - component)
+        remaining -= component
+        yield component
+
+
+def is_connected_dominating(graph, component, relays):
+    """
+    Check if every node of the component is a relay or adjacent to one,
+    and if all relays of the component are connected
+    """
+    relays = relays & component
+    if len(component) == 1:
+        return True
+    if not relays:
+        return False
+
+    for node in component:
+        if node not in relays and not graph[node] & relays:
+            return False
+
+    # all relays need to be reachable from any relay using only relays
+    start = next(iter(relays))
+    reached = {start}
+    pending = [start]
+    while pending:
+        node = pending.pop()
+        for neighbor in graph[node] & relays:
+            if neighbor not in reached:
+                reached.add(neighbor)
+                pending.append(neighbor)
+
+    return reached == relays
+
+
+def plan_relays(graph, forced=(), excluded=()):
+    """
+    Compute a small set of relays that still covers every node
+
+    Builds a connected dominating set per component greedily, by always
+    promoting the covered node that covers most uncovered nodes. Afterwards
+    all relays that are not required are removed again.
+
+    Components in which all nodes hear each other get no relays at all,
+    apart from forced ones.
+
+    Returns the relays and all nodes that could not be covered.
+    """
+    forced = set(forced)
+    excluded = set(excluded) - forced
+    relays = set(forced)
+    uncovered = set()
+
+    for component in components(graph):
+        # nodes that all hear each other directly do not need any relay
+        if all(graph[node] >= component - {node} for node in component):
+            continue
+
+        covered = set()
+        for relay in relays & component:
+            covered |= graph[relay] | {relay}
+
+        if not relays & component:
+            candidates = component - excluded
+            if not candidates:
+                uncovered |= component
+                continue
+            start = max(candidates, key=lambda node: len(graph[node]))
+            relays.add(start)
+            covered |= graph[start] | {start}
+
+        while covered != component:
+            candidates = [node for node in covered - relays - excluded if graph[node] - covered]
+            if not candidates:
+                uncovered |= component - covered
+                break
+
+            best = max(candidates, key=lambda node: len(graph[node] - covered))
+            relays.add(best)
+            covered |= graph[best] | {best}
+
+        # drop relays that are not required, least connected first
+        if not uncovered & component:
+            for relay in sorted(relays & component - forced, key=lambda node: len(graph[node])):
+                if is_connected_dominating(graph, component, relays - {relay}):
+                    relays.discard(relay)
+
+    return relays, uncovered
+
+
+class TopologyModule(Module):
+    """
+    Relay topology optimization
+
+    Collects hop counts between all nodes using heartbeats. Every node in turn
+    publishes heartbeats to a group address, while all other nodes report the
+    minimum hops of the heartbeats they received. Nodes that hear each other
+    directly are neighbors.
+
+    The gateway listens for heartbeats as well, but never relays itself. From
+    this graph a minimal set of relays is computed, that still covers every
+    node including the gateway. Nodes configured with `relay: auto` are set
+    accordingly.
+    """
+
+    # key of the gateway within the hop counts
+    GATEWAY = "gateway"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+    def setup_cli(self, parser):
+        parser.add_argument("task", choices=["collect", "plan", "apply"])
+        parser.add_argument("--group", type=lambda value: int(value, 0), default=0xC0FF)
+        parser.add_argument("--period", type=int, default=20, help="seconds to listen per node")
+        parser.add_argument("--count", type=int, default=10, help="heartbeats per node")
+
+    async def handle_cli(self, args):
+        if args.task == "collect":
+            await self._collect(args.group, args.period, args.count)
+            return
+
+        relays = self._plan()
+        if relays is None:
+            self.print("No hop counts available, run collect first")
+            return
+
+        if args.task == "apply":
+            await self._apply(relays)
+
+    def is_relay(self, node):
+        """
+        Check if a node should relay according to the applied plan
+        """
+        return str(node.uuid) in self.store.get("relays", [])
+
+    def _candidates(self):
+        return [node for node in self.app.nodes.all() if node.configured]
+
+    async def _collect(self, group, period, count):
+        """
+        Measure the hop counts between all nodes
+        """
+        client = self.app.client(models.ConfigClient)
+        nodes = self._candidates()
+        hops = {}
+
+        for source in nodes:
+            logger.info("Collecting heartbeats from %s...", source)
+
+            # the gateway listens on the subnet of the source
+            listeners = [(str(node.uuid), node.unicast, node.net_index) for node in nodes if node is not source]
+            listeners.append((TopologyModule.GATEWAY, self.app.address, source.net_index))
+
+            for _, unicast, net_index in listeners:
+                await client.set_heartbeat_subscription(
+                    unicast, net_index=net_index, source=source.unicast, destination=group, period=period
+                )
+            await client.set_heartbeat_publication(
+                source.unicast,
+                net_index=source.net_index,
+                destination=group,
+                count=count,
+                period=max(period // count, 1),
+                ttl=127,
+                net_key_index=source.net_index,
+            )
+
+            await asyncio.sleep(period)
+
+            hops[str(source.uuid)] = {}
+            for key, unicast, net_index in listeners:
+                data = await client.get_heartbeat_subscription([unicast], net_index=net_index)
+                status = data.get(unicast)
+                if isinstance(status, dict) and status.get("count"):
+                    hops[str(source.uuid)][key] = status.get("min_hops")
+
+            # stop heartbeats
+            await client.set_heartbeat_publication(
+                source.unicast,
+                net_index=source.net_index,
+                destination=0,
+                count=0,
+                period=0,
+                ttl=0,
+                net_key_index=source.net_index,
+            )
+
+        self.store.set("hops", hops)
+        self.store.persist()
+
+        self.print(f"\nCollected hop counts of {len(hops)} node(s)")
+
+    def _plan(self):
+        """
+        Compute and print relay plan
+        """
+        hops = self.store.get("hops", None)
+        if not hops:
+            return None
+
+        nodes = {str(node.uuid): node for node in self._candidates()}
+
+        # nodes that hear each other directly are neighbors, the gateway needs to be covered as well
+        graph = {uuid: set() for uuid in [*nodes, TopologyModule.GATEWAY]}
+        for source, targets in hops.items():
+            for target, min_hops in targets.items():
+                if source in graph and target in graph and min_hops == 1:
+                    if hops.get(target, {}).get(source, 1) == 1:
+                        graph[source].add(target)
+                        graph[target].add(source)
+
+        # explicitly configured relay states are kept
+        forced = [uuid for uuid, node in nodes.items() if node.config.optional("relay", False) is True]
+        excluded = [uuid for uuid, node in nodes.items() if node.config.optional("relay", False) is False]
+        excluded.append(TopologyModule.GATEWAY)
+
+        relays, uncovered = plan_relays(graph, forced, excluded)
+
+        self.print(f"\nRelay plan for {len(nodes)} node(s), {len(relays)} relay(s):")
+        for uuid, node in nodes.items():
+            state = "relay" if uuid in relays else "-"
+            if node.config.optional("relay", False) == "auto" and (uuid in relays) != self.is_relay(node):
+                state += " (changed)"
+            if not graph[uuid]:
+                state += " (no neighbors)"
+            if uuid in uncovered:
+                state += " (uncovered)"
+            self.print(f"\t{node}: {state}")
+
+        if not graph[TopologyModule.GATEWAY]:
+            self.print("\tgateway: (no neighbors)")
+        elif TopologyModule.GATEWAY in uncovered:
+            self.print("\tgateway: (uncovered)")
+
+        return relays
+
+    async def _apply(self, relays):
+        """
+        Apply relay plan to all nodes configured with `relay: auto`
+        """
+        self.store.set("relays", sorted(relays))
+        self.store.persist()
+
+        provisioner = self.app.modules["prov"]
+        for node in self._candidates():
+            if node.config.optional("relay", False) == "auto":
+                await provisioner._set_relay(node)
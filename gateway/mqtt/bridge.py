@@ -1,7 +1,15 @@
-import json
+import time
 import logging
 import asyncio
 
+from tools import codec, tracer
+from tools.capture import recorder
+
+from .slot import CommandSlot
+
+
+logger = logging.getLogger(__name__)
+
 
 class HassMqttBridge:
     """
@@ -14,6 +22,18 @@ class HassMqttBridge:
     They can however be overriden, if more sophisticated behaviour is required.
     """
 
+    # dispatch tables are built once per bridge class
+    _commands = {}
+    _notifiers = {}
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+
+        cls._commands = {name[len("_mqtt_") :]: getattr(cls, name) for name in dir(cls) if name.startswith("_mqtt_")}
+        cls._notifiers = {
+            name[len("_notify_") :]: getattr(cls, name) for name in dir(cls) if name.startswith("_notify_")
+        }
+
     def __init__(self, messenger):
         self._messenger = messenger
 
@@ -21,49 +41,115 @@ class HassMqttBridge:
     def component(self):
         return None
 
-    def _property_change(self, node, property, value):
-        try:
-            # get handler from property name
-            handler = getattr(self, f"_notify_{property}")
-        except:
-            logging.warning(f"Missing handler for property {property}")
+    @property
+    def commands(self):
+        """
+        Names of all commands handled by this bridge
+        """
+        return list(self._commands)
+
+    def _property_change(self, node, property, value, element=0):
+        handler = self._notifiers.get(property)
+        if handler is None:
+            logger.warning("Missing handler for property %s", property)
             return
 
         # TODO: track task
-        asyncio.create_task(handler(node, value))
+        asyncio.create_task(handler(self, node, value, element))
 
     async def listen(self, node):
         """
         Listen for incoming messages and node changes
+
+        Every element of the node is a separate entity with its own listener.
         """
 
+        # publish the last known state right away
+        subscribed = node.stale()
+        if subscribed:
+            node.subscribe(self._property_change, resend=True)
+
         # send node configuration for MQTT discovery
         await node.ready.wait()
-        await self.config(node)
+        for element in self._messenger.elements(node):
+            await self.config(node, element=element)
 
         # listen for node changes (this will also push the initial state)
-        node.subscribe(self._property_change, resend=True)
+        if not subscribed:
+            node.subscribe(self._property_change, resend=True)
+
+        await asyncio.gather(*(self._listen_element(node, element) for element in self._messenger.elements(node)))
+
+    async def _listen_element(self, node, element):
+        # commands are handled one at a time, newer commands replace pending ones
+        slot = CommandSlot(
+            lambda command, payload: self._commands[command](self, node, payload, element),
+            interval=node.config.optional("min_interval", 0),
+        )
+        worker = asyncio.create_task(slot.run())
+        try:
+            await self._receive(node, slot, element)
+        finally:
+            worker.cancel()
 
-        # listen for incoming MQTT messages
-        async with self._messenger.filtered_messages(self.component, node) as messages:
+    async def _receive(self, node, slot, element=0):
+        """
+        Pass incoming MQTT messages to the command slot
+        """
+        async with self._messenger.filtered_messages(self.component, node, element=element) as messages:
             async for message in messages:
-                logging.info(f"Received message on {message.topic}:\n{message.payload}")
+                logger.debug("Received message on %s:\n%s", message.topic, message.payload)
+                recorder.mqtt(message.topic, message.payload)
 
-                # get command from topic and load message
-                command = message.topic.split("/")[-1]
-                payload = json.loads(message.payload.decode())
+                # commands are handled by the shard that publishes the node
+                if not self._messenger.owns(node):
+                    continue
 
-                try:
-                    # get handler from command name
-                    handler = getattr(self, f"_mqtt_{command}")
-                except:
-                    logging.warning(f"Missing handler for command {command}")
+                # get handler from topic before decoding the message
+                command = message.topic.rsplit("/", 1)[-1]
+                if command not in self._commands:
+                    logger.warning("Missing handler for command %s", command)
                     continue
 
-                await handler(node, payload)
+                with tracer.trace("mqtt.command", topic=message.topic):
+                    # time spent in the client queue
+                    tracer.record("mqtt.queue", time.monotonic() - message.timestamp)
+
+                    with tracer.span("mqtt.decode"):
+                        payload = codec.loads(message.payload)
+                    slot.submit(command, payload)
 
-    async def config(self, node):
+    async def republish(self, node):
         """
-        Send discovery message
+        Resend discovery message and retained state
+        """
+        for element in self._messenger.elements(node):
+            await self.config(node, force=True, element=element)
+            await self.republish_state(node, element)
+
+    async def republish_state(self, node, element=0):
+        """
+        Resend the retained state of an element
+
+        Runs the handler of every retained property. Bridges that publish
+        the full state from every handler should send it only once.
+        """
+        for property, value in node.retained_items(element):
+            handler = self._notifiers.get(property)
+            if handler is not None:
+                await handler(self, node, value, element)
+
+    async def remove(self, node):
+        """
+        Remove discovery messages
+        """
+        for element in self._messenger.elements(node):
+            await self._messenger.clear_config(self.component, node, element=element)
+
+    async def config(self, node, force=False, element=0):
+        """
+        Send discovery message for an element
+
+        Unchanged discovery messages are skipped, unless forced.
         """
         pass
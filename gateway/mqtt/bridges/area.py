@@ -0,0 +1,59 @@
+import asyncio
+
+from mqtt.bridge import HassMqttBridge
+
+
+class AreaBridge(HassMqttBridge):
+    """
+    Bridge for area aggregates
+
+    Exposes the number of lights turned on and their average brightness as
+    sensors. Changes are published at most once per summary interval.
+    """
+
+    SENSORS = {
+        "on": {"name": "lights on", "unit_of_meas": "lights"},
+        "brightness": {"name": "brightness", "unit_of_meas": "%"},
+    }
+
+    @property
+    def component(self):
+        return "sensor"
+
+    async def listen(self, area):
+        await area.ready.wait()
+        await self.config(area)
+
+        while True:
+            await area.changed.wait()
+            area.changed.clear()
+
+            await self._state(area)
+            await asyncio.sleep(area.config.optional("summary_interval", 5))
+
+    async def _state(self, area):
+        await self._messenger.publish(self.component, area, "state", area.state(), retain=True)
+
+    async def config(self, area, force=False, element=0):
+        for sensor, info in AreaBridge.SENSORS.items():
+            id = f"{area.config.require('id')}_{sensor}"
+            message = {
+                "~": self._messenger.node_topic(self.component, area),
+                "name": f"{area.config.require('name')} {info['name']}",
+                "uniq_id": id,
+                "obj_id": id,
+                "stat_t": "~/state",
+                "val_tpl": f"{{{{ value_json.{sensor} }}}}",
+                "unit_of_meas": info["unit_of_meas"],
+                "stat_cla": "measurement",
+            }
+
+            await self._messenger.publish_config(self.component, area, message, force=force, object_id=id)
+
+    async def remove(self, area):
+        for sensor in AreaBridge.SENSORS:
+            await self._messenger.clear_config(self.component, f"{area.config.require('id')}_{sensor}")
+
+    async def republish(self, area):
+        await self.config(area, force=True)
+        await self._state(area)
@@ -1,4 +1,3 @@
-from sre_constants import BIGCHARSET
 from mqtt.bridge import HassMqttBridge
 from mesh.nodes.light import Light
 
@@ -11,27 +10,36 @@ class GenericLightBridge(HassMqttBridge):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
+        # last published stale flag per node and element
+        self._stale = {}
+
     @property
     def component(self):
         return "light"
 
-    async def config(self, node):
+    async def config(self, node, force=False, element=0):
+        id = self._messenger.entity_id(node, element)
+        name = node.config.optional("name")
+        if element:
+            name = (node.config.optional("element_names", None) or {}).get(element, f"{name} {element}")
+
         color_modes = set()
         message = {
-            "~": self._messenger.node_topic(self.component, node),
-            "name": node.config.optional("name"),
-            "unique_id": node.config.require("id"),
-            "object_id": node.config.require("id"),
-            "command_topic": "~/set",
-            "state_topic": "~/state",
+            "~": self._messenger.node_topic(self.component, node, element),
+            "name": name,
+            "uniq_id": id,
+            "obj_id": id,
+            "cmd_t": "~/set",
+            "stat_t": "~/state",
+            "json_attr_t": "~/attributes",
             "schema": "json",
         }
 
-        if node.supports(Light.BrightnessProperty):
-            message["brightness_scale"] = 50
+        if node.supports(Light.BrightnessProperty, element):
+            message["bri_scl"] = 50
             message["brightness"] = True
 
-        if node.supports(Light.TemperatureProperty):
+        if node.supports(Light.TemperatureProperty, element):
             color_modes.add("color_temp")
             # convert from Kelvin to mireds
             # TODO: look up max/min values from device
@@ -40,11 +48,11 @@ class GenericLightBridge(HassMqttBridge):
 
         if color_modes:
             message["color_mode"] = True
-            message["supported_color_modes"] = list(color_modes)
+            message["sup_clrm"] = sorted(color_modes)
 
-        await self._messenger.publish(self.component, node, "config", message)
+        await self._messenger.publish_config(self.component, node, message, force=force, object_id=id)
 
-    async def _state(self, node, onoff):
+    async def _state(self, node, onoff, element=0):
         """
         Send a generic state message covering the nodes full state
 
@@ -53,25 +61,44 @@ class GenericLightBridge(HassMqttBridge):
         """
         message = {"state": "ON" if onoff else "OFF"}
 
-        if onoff and node.supports(Light.BrightnessProperty):
-            message["brightness"] = node.retained(Light.BrightnessProperty, 100)
-        if onoff and node.supports(Light.TemperatureProperty):
-            message["color_temp"] = node.retained(Light.TemperatureProperty, 100)
+        if onoff and node.supports(Light.BrightnessProperty, element):
+            message["brightness"] = node.retained(Light.BrightnessProperty, 100, element)
+        if onoff and node.supports(Light.TemperatureProperty, element):
+            message["color_temp"] = node.retained(Light.TemperatureProperty, 100, element)
+
+        await self._messenger.publish(self.component, node, "state", message, retain=True, element=element)
 
-        await self._messenger.publish(self.component, node, "state", message, retain=True)
+        # mark restored state until it is confirmed by the node
+        stale = node.stale(element)
+        if self._stale.get((node, element)) != stale:
+            self._stale[(node, element)] = stale
+            await self._messenger.publish(
+                self.component, node, "attributes", {"stale": stale}, retain=True, element=element
+            )
 
-    async def _mqtt_set(self, node, payload):
+    async def _mqtt_set(self, node, payload, element=0):
         if "color_temp" in payload:
-            await node.set_mireds(payload["color_temp"])
+            await node.set_mireds(payload["color_temp"], element)
         if "brightness" in payload:
-            await node.set_brightness(payload["brightness"])
+            await node.set_brightness(payload["brightness"], element)
         if payload.get("state") == "ON":
-            await node.turn_on()
+            await node.turn_on(element)
         if payload.get("state") == "OFF":
-            await node.turn_off()
+            await node.turn_off(element)
+
+    async def republish_state(self, node, element=0):
+        # every state message covers all properties
+        onoff = node.retained(Light.OnOffProperty, None, element)
+        if onoff is None:
+            brightness = node.retained(Light.BrightnessProperty, None, element)
+            if brightness is None:
+                return
+            onoff = brightness > 0
+
+        await self._state(node, onoff, element)
 
-    async def _notify_onoff(self, node, onoff):
-        await self._state(node, onoff)
+    async def _notify_onoff(self, node, onoff, element=0):
+        await self._state(node, onoff, element)
 
-    async def _notify_brightness(self, node, brightness):
-        await self._state(node, brightness > 0)
+    async def _notify_brightness(self, node, brightness, element=0):
+        await self._state(node, brightness > 0, element)
@@ -0,0 +1,38 @@
+import json
+
+from mqtt.bridge import HassMqttBridge
+
+
+class SceneBridge(HassMqttBridge):
+    """
+    Bridge for mesh scenes
+
+    Recalls the scene when activated from Home Assistant. Publishing to the
+    scene's store topic stores the current state of all members as the scene.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+    @property
+    def component(self):
+        return "scene"
+
+    async def config(self, scene, force=False, element=0):
+        message = {
+            "~": self._messenger.node_topic(self.component, scene),
+            "name": scene.config.optional("name"),
+            "uniq_id": scene.config.require("id"),
+            "obj_id": scene.config.require("id"),
+            "cmd_t": "~/set",
+            "pl_on": json.dumps({"state": "ON"}),
+        }
+
+        await self._messenger.publish_config(self.component, scene, message, force=force)
+
+    async def _mqtt_set(self, scene, payload, element=0):
+        if payload.get("state") == "ON":
+            await scene.recall()
+
+    async def _mqtt_store(self, scene, payload, element=0):
+        await scene.store()
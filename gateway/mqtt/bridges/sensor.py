@@ -0,0 +1,147 @@
+import asyncio
+
+from mqtt.bridge import HassMqttBridge
+
+
+class Window:
+    """
+    Aggregates the readings of a single property
+    """
+
+    def __init__(self):
+        self.last = None
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+        self.last = value
+
+    def stats(self):
+        return {
+            "min": self.min,
+            "max": self.max,
+            "mean": round(self.total / self.count, 3),
+            "last": self.last,
+        }
+
+
+class GenericSensorBridge(HassMqttBridge):
+    """
+    Generic bridge for sensors
+
+    Readings are aggregated over a configurable window, before they are
+    published. Every property is exposed as a separate sensor, using the
+    configured aggregate (mean by default) as its state. All aggregates
+    are available as attributes.
+    """
+
+    DEVICE_CLASSES = {
+        "illuminance": ("illuminance", "lx"),
+        "temperature": ("temperature", "°C"),
+        "power": ("power", "W"),
+        "energy": ("energy", "kWh"),
+    }
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        # aggregation windows per node and property
+        self._windows = {}
+        # latest aggregates per node and property
+        self._aggregates = {}
+
+    @property
+    def component(self):
+        return "sensor"
+
+    def _property_change(self, node, property, value, element=0):
+        # restored readings were already published by a previous run
+        if node.stale(element, property):
+            return
+
+        windows = self._windows.setdefault(node, {})
+        if property not in windows:
+            windows[property] = Window()
+        windows[property].add(value)
+
+    async def listen(self, node):
+        flush = self._messenger.tasks.spawn(self._flush(node), f"flush {node}")
+        try:
+            await super().listen(node)
+        finally:
+            flush.cancel()
+
+    async def _flush(self, node):
+        """
+        Publish aggregated readings at the end of every window
+        """
+        await node.ready.wait()
+
+        published = set()
+        while True:
+            await asyncio.sleep(node.config.optional("window", 60))
+
+            windows = self._windows.get(node, {})
+            if not any(window.count for window in windows.values()):
+                continue
+
+            # announce properties that were not seen before
+            for property in windows:
+                if property not in published:
+                    await self._config_property(node, property)
+                    published.add(property)
+
+            await self._state(node)
+
+    async def _state(self, node):
+        aggregate = node.config.optional("aggregate", "mean")
+        attributes = self._aggregates.setdefault(node, {})
+
+        for property, window in self._windows.get(node, {}).items():
+            if window.count:
+                attributes[property] = window.stats()
+                window.reset()
+
+        state = {property: stats[aggregate] for property, stats in attributes.items()}
+
+        await self._messenger.publish(self.component, node, "state", state, retain=True)
+        await self._messenger.publish(self.component, node, "attributes", attributes, retain=True)
+
+    async def _config_property(self, node, property, force=False):
+        id = f"{node.config.require('id')}_{property}"
+        message = {
+            "~": self._messenger.node_topic(self.component, node),
+            "name": f"{node.config.optional('name', node.config.require('id'))} {property.replace('_', ' ')}",
+            "uniq_id": id,
+            "obj_id": id,
+            "stat_t": "~/state",
+            "val_tpl": f"{{{{ value_json.{property} }}}}",
+            "json_attr_t": "~/attributes",
+            "json_attr_tpl": f"{{{{ value_json.{property} | tojson }}}}",
+            "stat_cla": "measurement",
+        }
+
+        if property in GenericSensorBridge.DEVICE_CLASSES:
+            message["dev_cla"], message["unit_of_meas"] = GenericSensorBridge.DEVICE_CLASSES[property]
+
+        await self._messenger.publish_config(self.component, node, message, force=force, object_id=id)
+
+    async def config(self, node, force=False, element=0):
+        for property in self._windows.get(node, {}):
+            await self._config_property(node, property, force=force)
+
+    async def remove(self, node):
+        for property in self._windows.pop(node, {}):
+            await self._messenger.clear_config(self.component, f"{node.config.require('id')}_{property}")
+
+    async def republish(self, node):
+        await self.config(node, force=True)
@@ -1,17 +1,27 @@
-import json
+import asyncio
+import hashlib
 import logging
 
-from asyncio_mqtt.client import Client, MqttError
+from asyncio_mqtt.client import Client, MqttError, Will
 from contextlib import AsyncExitStack
 
-from mesh import Node
-from tools import Tasks
+from tools import Tasks, codec, traced, tracer
 
+from .shards import ShardCoordinator
+from .bridges import area
 from .bridges import light
+from .bridges import scene
+from .bridges import sensor
+
+
+logger = logging.getLogger(__name__)
 
 
 BRIDGES = {
     "light": light.GenericLightBridge,
+    "scene": scene.SceneBridge,
+    "sensor": sensor.GenericSensorBridge,
+    "area": area.AreaBridge,
 }
 
 
@@ -23,18 +33,58 @@ class HassMqttMessenger:
     manages tasks to receive and handle incoming messages.
     """
 
-    def __init__(self, config, nodes):
+    # time to wait for further retained discovery messages on startup
+    DISCOVERY_QUIET = 1.0
+    # delay to persist discovery hashes once per burst of messages
+    DISCOVERY_PERSIST_DELAY = 5.0
+
+    def __init__(self, config, nodes, store, shard):
         self._config = config
         self._nodes = nodes
+        self._store = store
         self._bridges = {}
         self._paths = {}
+        self._tasks = None
+        self._listeners = {}
+        self._modules = config.optional("mqtt.modules", False)
+        self._profile = config.optional("diagnostics.profile", False)
+        self._topic = config.optional("mqtt.topic", "mqtt_mesh")
+
+        # quality of service per message class
+        self._qos = {
+            kind: config.optional(f"mqtt.qos.{kind}", default)
+            for kind, default in (("state", 0), ("discovery", 1), ("availability", 1))
+        }
+
+        # publishes are pipelined up to a bounded number of unconfirmed messages
+        self._inflight = asyncio.Semaphore(config.optional("mqtt.max_inflight", 16))
+        self._deliveries = set()
+        # first failed delivery, raised by the next publish
+        self._failure = None
+
+        # coordinate with other gateway shards
+        self._coordinator = None
+        self._availability_topic = f"{self._topic}/status"
+        if shard.enabled:
+            self._coordinator = ShardCoordinator(self, shard)
+            self._availability_topic = self._coordinator.status_topic
 
         self._client = Client(
             self._config.require("mqtt.broker"),
             username=self._config.optional("mqtt.username"),
             password=self._config.optional("mqtt.password"),
+            will=Will(self._availability_topic, b"offline", qos=self.qos("availability"), retain=True),
         )
-        self._topic = config.optional("mqtt.topic", "mqtt_mesh")
+        self._birth_topic = config.optional("mqtt.birth_topic", "homeassistant/status")
+        self._republish_rate = config.optional("mqtt.republish_rate", 10)
+        self._republish_task = None
+
+        # hashes of retained discovery messages are only valid for the same broker
+        self._discovery = self._store.section("discovery")
+        if self._store.get("broker") != self._config.require("mqtt.broker"):
+            self._discovery.reset()
+            self._store.set("broker", self._config.require("mqtt.broker"))
+        self._persist_task = None
 
         # initialize bridges
         for name, constructor in BRIDGES.items():
@@ -44,53 +94,431 @@ class HassMqttMessenger:
     def client(self):
         return self._client
 
+    @client.setter
+    def client(self, client):
+        self._client = client
+
     @property
     def topic(self):
         return self._topic
 
-    def node_topic(self, component, node):
+    @property
+    def tasks(self):
         """
-        Return base topic for a specific node
+        Task pool of the running messenger
+        """
+        return self._tasks
+
+    def qos(self, kind):
+        """
+        Quality of service for a class of messages (state, discovery or availability)
+        """
+        return self._qos[kind]
+
+    def entity_id(self, node, element=0):
+        """
+        Return the entity id of a node's element
+
+        The first element uses the id of the node, all others append their index.
         """
-        if isinstance(node, Node):
+        if not isinstance(node, str):
             node = node.config.require("id")
 
-        return f"homeassistant/{component}/{self._topic}/{node}"
+        return f"{node}_{element}" if element else node
+
+    def elements(self, node):
+        """
+        Return the elements of a node exposed as separate entities
+
+        The number of elements is only known once a node is bound. Elements
+        whose entity id equals the id of another node are not exposed.
+        """
+        ids = {other.config.optional("id") for other in self._nodes.all() if other is not node}
+
+        elements = []
+        for element in node.elements:
+            if element and self.entity_id(node, element) in ids:
+                logger.error("Element %s of %s collides with node %s", element, node, self.entity_id(node, element))
+                continue
+            elements.append(element)
+        return elements
 
-    def filtered_messages(self, component, node, topic="#"):
+    def node_topic(self, component, node, element=0):
+        """
+        Return base topic for a specific node
+        """
+        return f"homeassistant/{component}/{self._topic}/{self.entity_id(node, element)}"
+
+    def command_topics(self):
+        """
+        Return subscriptions for all commands handled by the bridges
+        """
+        topics = [self._birth_topic]
+
+        if self._coordinator:
+            topics.extend(self._coordinator.topics)
+        if self._profile:
+            topics.append(f"{self._topic}/diagnostics/profile")
+        if self._modules:
+            topics.append(f"{self._topic}/modules/+/run")
+
+        for bridge in self._bridges.values():
+            for command in bridge.commands:
+                topics.append(f"homeassistant/{bridge.component}/{self._topic}/+/{command}")
+
+        return topics
+
+    def owns(self, node):
+        """
+        Check if this gateway is responsible for publishing a specific node
+        """
+        if self._coordinator is None:
+            return True
+        return self._coordinator.owns(node)
+
+    def filtered_messages(self, component, node, topic="#", element=0):
         """
         Shorthand to get messages for a specific node
         """
-        return self._client.filtered_messages(f"{self.node_topic(component, node)}/{topic}")
+        return self._client.filtered_messages(f"{self.node_topic(component, node, element)}/{topic}")
+
+    async def send(self, topic, payload, kind="state", retain=False):
+        """
+        Publish a message without waiting for the broker to confirm it
+
+        Waits only if the maximum number of unconfirmed messages is reached.
+        Messages are passed to the client in order. Raises the error of a
+        previously failed delivery, i.e. if the broker connection was lost.
+        """
+        if self._failure:
+            raise self._failure
+
+        await self._inflight.acquire()
+
+        delivery = asyncio.create_task(self._deliver(topic, payload, self._qos[kind], retain))
+        self._deliveries.add(delivery)
+        delivery.add_done_callback(self._deliveries.discard)
+
+    async def _deliver(self, topic, payload, qos, retain):
+        try:
+            # deliveries inherit the trace of the publishing command
+            with tracer.span("mqtt.publish"):
+                await self._client.publish(topic, payload, qos=qos, retain=retain)
+        except MqttError as e:
+            logger.warning("Failed to publish %s: %s", topic, e)
+            self._failure = self._failure or e
+        finally:
+            self._inflight.release()
+
+    async def flush(self):
+        """
+        Wait for all pending deliveries
+        """
+        if self._deliveries:
+            await asyncio.gather(*self._deliveries, return_exceptions=True)
 
-    async def publish(self, component, node, topic, message, **kwargs):
+    @traced("mqtt.enqueue")
+    async def publish(self, component, node, topic, message, kind="state", retain=False, element=0):
         """
         Send a state update for a specific nde
+
+        Updates of entities published by another shard are dropped.
         """
+        if not isinstance(node, str) and not self.owns(node):
+            return
+
         if isinstance(message, dict):
-            message = json.dumps(message)
+            message = codec.dumps(message)
+        elif not isinstance(message, bytes):
+            message = str(message).encode()
+
+        await self.send(f"{self.node_topic(component, node, element)}/{topic}", message, kind, retain)
+
+    async def publish_config(self, component, node, message, force=False, object_id=None):
+        """
+        Send a retained discovery message for a specific node
+
+        Nodes exposing multiple entities can pass a separate object id for each.
+        The message is skipped if an identical message was already retained
+        on the broker by a previous run, unless forced.
+        """
+        if self._coordinator:
+            await self._coordinator.ready.wait()
+        if not self.owns(node):
+            logger.debug("Discovery for %s is published by another shard", node)
+            return False
+
+        # entities become unavailable with this gateway
+        message = {**message, "avty_t": self._availability_topic}
+
+        topic = f"{self.node_topic(component, object_id or node)}/config"
+        digest = self._digest(message)
+
+        if not force and self._discovery.has(topic) and self._discovery.get(topic) == digest:
+            logger.debug("Discovery for %s unchanged", topic)
+            return False
+
+        await self.publish(component, object_id or node, "config", message, kind="discovery", retain=True)
+
+        self._discovery.set(topic, digest)
+        self._discovery_changed()
+        return True
+
+    async def clear_config(self, component, node, element=0):
+        """
+        Remove a node from Home Assistant by clearing its discovery message
+        """
+        topic = f"{self.node_topic(component, node, element)}/config"
+
+        await self.send(topic, b"", kind="discovery", retain=True)
 
-        await self._client.publish(f"{self.node_topic(component, node)}/{topic}", str(message).encode(), **kwargs)
+        if self._discovery.has(topic):
+            self._discovery.delete(topic)
+            self._discovery_changed()
+
+    def _discovery_changed(self):
+        # persist once after a burst of discovery messages
+        if self._persist_task is None or self._persist_task.done():
+            self._persist_task = self._tasks.spawn(self._persist_discovery(), "persist discovery")
+
+    async def _persist_discovery(self):
+        await asyncio.sleep(HassMqttMessenger.DISCOVERY_PERSIST_DELAY)
+        self._discovery.persist()
+
+    @staticmethod
+    def _digest(message):
+        return hashlib.sha1(codec.dumps(message, sort_keys=True)).hexdigest()
+
+    async def _sync_discovery(self):
+        """
+        Forget discovery messages, that are no longer retained by the broker
+
+        All retained discovery messages of this gateway are received right
+        after subscribing. Messages that were removed or changed by someone
+        else are published again.
+        """
+        topic = f"homeassistant/+/{self._topic}/+/config"
+        retained = {}
+
+        async with self._client.filtered_messages(topic) as messages:
+            await self._client.subscribe(topic, qos=self.qos("discovery"))
+            try:
+                while True:
+                    message = await asyncio.wait_for(messages.__anext__(), HassMqttMessenger.DISCOVERY_QUIET)
+                    if message.retain and message.payload:
+                        retained[message.topic] = message.payload
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                await self._client.unsubscribe(topic)
+
+        for topic, digest in list(self._discovery.items()):
+            try:
+                valid = topic in retained and self._digest(codec.loads(retained[topic])) == digest
+            except:
+                valid = False
+
+            if not valid:
+                logger.debug("Discovery for %s is not retained by the broker", topic)
+                self._discovery.delete(topic)
+
+    def add(self, node):
+        """
+        Start bridging a node
+        """
+        if self._tasks is None:
+            # all nodes are added once the messenger is running
+            return
+
+        bridge = self._bridges.get(node.type)
+
+        if bridge is None:
+            logger.warning("No MQTT bridge for node %s (%s)", node, node.type)
+            return
+
+        self._listeners[node] = self._tasks.spawn(bridge.listen(node), f"bridge {node}")
+
+    async def remove(self, node, clear=False):
+        """
+        Stop bridging a node and optionally remove it from Home Assistant
+        """
+        listener = self._listeners.pop(node, None)
+        if listener is None:
+            return
+
+        listener.cancel()
+
+        if clear and self.owns(node):
+            await self._bridges[node.type].remove(node)
+
+    async def refresh(self, node):
+        """
+        Send the discovery message of a node that might have changed
+        """
+        if node in self._listeners and node.ready.is_set():
+            for element in self.elements(node):
+                await self._bridges[node.type].config(node, element=element)
+
+    async def _run_modules(self, modules):
+        """
+        Run application modules on request
+
+        Modules are run one at a time. Their output is published to the
+        result topic of the module.
+        """
+        async with self._client.filtered_messages(f"{self._topic}/modules/+/run") as messages:
+            async for message in messages:
+                name = message.topic.split("/")[-2]
+                if name not in modules:
+                    logger.warning("Unknown module %s", name)
+                    continue
+
+                try:
+                    argv = codec.loads(message.payload)
+                except:
+                    argv = None
+
+                if not isinstance(argv, list) or not all(isinstance(arg, str) for arg in argv):
+                    logger.warning("Invalid arguments for module %s: %s", name, message.payload)
+                    result = {"args": None, "error": "arguments must be a list of strings"}
+                else:
+                    logger.info("Running module %s %s", name, argv)
+                    try:
+                        result = {"args": argv, "output": await modules[name].handle_command(name, argv)}
+                    except:
+                        logger.exception("Module %s failed", name)
+                        result = {"args": argv, "error": "failed"}
+
+                await self.send(f"{self._topic}/modules/{name}/result", codec.dumps(result))
+
+    async def publish_diagnostics(self, data, name="loop"):
+        """
+        Send diagnostic information of the gateway
+        """
+        await self.send(f"{self._topic}/diagnostics/{name}", codec.dumps(data))
+
+    async def _run_profiler(self, profiler):
+        """
+        Capture profiles on request
+
+        The payload may contain the duration in seconds.
+        """
+        async with self._client.filtered_messages(f"{self._topic}/diagnostics/profile") as messages:
+            async for message in messages:
+                try:
+                    request = codec.loads(message.payload) if message.payload else {}
+                    result = {"file": await profiler.profile(request.get("duration"))}
+                except:
+                    logger.exception("Failed to profile")
+                    result = {"error": "failed"}
+
+                await self.publish_diagnostics(result, "profile/result")
+
+    async def _republish(self):
+        """
+        Resend discovery and state for all nodes
+
+        Nodes are handled in order of their configured priority and paced
+        by the configured rate (nodes per second).
+        """
+        nodes = [
+            node for node in self._nodes.all() if node.ready.is_set() and node.type in self._bridges and self.owns(node)
+        ]
+        nodes.sort(key=lambda node: node.config.optional("priority", 0), reverse=True)
+        interval = 1.0 / self._republish_rate if self._republish_rate else 0
+
+        logger.info("Republishing %s node(s)...", len(nodes))
+
+        for index, node in enumerate(nodes, start=1):
+            try:
+                await self._bridges[node.type].republish(node)
+            except MqttError:
+                raise
+            except:
+                logger.exception("Failed to republish %s", node)
+
+            await self.send(f"{self._topic}/republish", codec.dumps({"done": index, "total": len(nodes)}))
+            if index % 10 == 0 or index == len(nodes):
+                logger.info("Republished %s/%s node(s)", index, len(nodes))
+
+            if index < len(nodes):
+                await asyncio.sleep(interval)
+
+    async def _watch_birth(self):
+        """
+        Republish everything when Home Assistant comes online
+        """
+        async with self._client.filtered_messages(self._birth_topic) as messages:
+            async for message in messages:
+                if message.payload.decode() != "online":
+                    continue
+
+                logger.info("Home Assistant came online")
+
+                # restart a republish that is still in progress
+                if self._republish_task and not self._republish_task.done():
+                    self._republish_task.cancel()
+                self._republish_task = self._tasks.spawn(self._republish(), "republish nodes")
+
+    async def _takeover(self, entity):
+        """
+        Publish an entity that was previously published by another shard
+        """
+        bridge = self._bridges.get(getattr(entity, "type", "scene"))
+
+        if bridge and entity.ready.is_set():
+            await bridge.republish(entity)
 
     async def run(self, app):
         async with AsyncExitStack() as stack:
             tasks = await stack.enter_async_context(Tasks())
+            self._tasks = tasks
 
             # connect to MQTT broker
             await stack.enter_async_context(self._client)
+            self._failure = None
+
+            # deliver pending messages before disconnecting
+            stack.push_async_callback(self.flush)
+            stack.callback(self._discovery.persist)
+
+            # only skip discovery messages that are still retained
+            await self._sync_discovery()
+
+            # announce this gateway, shards are announced by the coordinator
+            if not self._coordinator:
+                await self.send(self._availability_topic, b"online", kind="availability", retain=True)
+
+            # react to Home Assistant restarts
+            tasks.spawn(self._watch_birth(), "watch birth messages")
+
+            # announce this shard
+            if self._coordinator:
+                entities = [*self._nodes.all(), *app.scenes, *app.areas]
+                tasks.spawn(self._coordinator.run(entities, self._takeover), "coordinate shards")
 
             # spawn tasks for every node
             for node in self._nodes.all():
-                bridge = self._bridges.get(node.type)
+                self.add(node)
+
+            # spawn tasks for every scene
+            for entity in app.scenes:
+                tasks.spawn(self._bridges["scene"].listen(entity), f"bridge {entity}")
+
+            # spawn tasks for every area
+            for entity in app.areas:
+                tasks.spawn(self._bridges["area"].listen(entity), f"bridge {entity}")
 
-                if bridge is None:
-                    logging.warning(f"No MQTT bridge for node {node} ({node.type})")
-                    return
+            # capture profiles on request
+            if self._profile:
+                tasks.spawn(self._run_profiler(app.profiler), "run profiler")
 
-                tasks.spawn(bridge.listen(node), f"bridge {node}")
+            # allow to run modules within the gateway
+            if self._modules:
+                tasks.spawn(self._run_modules(app.modules), "run modules")
 
-            # global subscription to messages
-            await self._client.subscribe("homeassistant/#")
+            # only subscribe to messages handled by this gateway
+            await self._client.subscribe([(topic, 0) for topic in self.command_topics()])
 
             # wait for all tasks
             await tasks.gather()
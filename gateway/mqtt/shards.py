@@ -0,0 +1,104 @@
+import asyncio
+import logging
+
+from tools import codec
+
+
+logger = logging.getLogger(__name__)
+
+
+class ShardCoordinator:
+    """
+    Coordinates multiple gateway shards over MQTT
+
+    Every shard announces its availability and the entities it serves using
+    retained messages. If an entity is served by multiple shards, only the first
+    available shard it is assigned to publishes discovery and handles commands.
+    Once that shard goes offline, the next one takes over.
+    """
+
+    # time to receive retained announcements of other shards
+    SETTLE_TIME = 2.0
+
+    def __init__(self, messenger, shard):
+        self._messenger = messenger
+        self._shard = shard
+        self._entities = []
+
+        # announcements of all shards
+        self._online = {shard.name}
+        self._claims = {}
+
+        self.ready = asyncio.Event()
+
+    def _topic(self, name, kind):
+        return f"{self._messenger.topic}/shards/{name}/{kind}"
+
+    @property
+    def status_topic(self):
+        return self._topic(self._shard.name, "status")
+
+    @property
+    def topics(self):
+        return [self._topic("+", "+")]
+
+    def _id(self, entity):
+        return entity.config.optional("id")
+
+    def owns(self, entity):
+        """
+        Check if this shard is responsible for the given entity
+        """
+        id = self._id(entity)
+
+        for name in self._shard.assigned(id, entity.config):
+            if name == self._shard.name:
+                return True
+            if name in self._online and id in self._claims.get(name, ()):
+                return False
+
+        return False
+
+    def _update(self, name, kind, payload):
+        if kind == "status":
+            if payload == "online":
+                self._online.add(name)
+            else:
+                self._online.discard(name)
+        if kind == "nodes":
+            self._claims[name] = set(codec.loads(payload or "[]"))
+
+    async def run(self, entities, takeover):
+        """
+        Announce this shard and track the announcements of all other shards
+
+        The takeover callback is invoked for every entity this shard becomes
+        responsible for while running.
+        """
+        client = self._messenger.client
+
+        self._entities = entities
+        claims = sorted(self._id(entity) for entity in entities if self._shard.owns(self._id(entity), entity.config))
+
+        async with client.filtered_messages(self._topic("+", "+")) as messages:
+            qos = self._messenger.qos("availability")
+            await client.publish(self.status_topic, b"online", qos=qos, retain=True)
+            await client.publish(self._topic(self._shard.name, "nodes"), codec.dumps(claims), qos=qos, retain=True)
+
+            asyncio.get_running_loop().call_later(ShardCoordinator.SETTLE_TIME, self.ready.set)
+
+            async for message in messages:
+                _, _, name, kind = message.topic.split("/")[-4:]
+                if name == self._shard.name:
+                    continue
+
+                owned = [entity for entity in self._entities if self.owns(entity)]
+                self._update(name, kind, message.payload.decode())
+
+                if not self.ready.is_set():
+                    continue
+
+                for entity in self._entities:
+                    if entity not in owned and self.owns(entity):
+                        logger.info("Shard %s took over %s", self._shard, entity)
+                        await takeover(entity)
@@ -0,0 +1,71 @@
+import time
+import asyncio
+import logging
+
+from tools import tracer
+
+
+logger = logging.getLogger(__name__)
+
+
+class CommandSlot:
+    """
+    Latest-wins command slot of a single node
+
+    Holds at most one pending payload per command. A newer payload is merged
+    into the pending one, so newer values replace older values of the same
+    attributes. Intermediate values, like those of a dragged slider, are
+    therefore skipped once the node falls behind.
+
+    A worker runs the pending commands, keeping an optional minimum interval
+    between them.
+    """
+
+    def __init__(self, handler, interval=0):
+        self._handler = handler
+        self._interval = interval
+
+        # pending payload, trace context and submit time per command
+        self._pending = {}
+        self._wakeup = asyncio.Event()
+        self._last = 0
+
+    def submit(self, command, payload):
+        """
+        Queue a command, replacing values of a pending one
+        """
+        if command in self._pending:
+            pending, _, submitted = self._pending[command]
+            if isinstance(pending, dict) and isinstance(payload, dict):
+                payload = {**pending, **payload}
+        else:
+            submitted = time.monotonic()
+
+        self._pending[command] = (payload, tracer.context(), submitted)
+        self._wakeup.set()
+
+    async def run(self):
+        """
+        Run pending commands until cancelled
+        """
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+
+            while self._pending:
+                # newer commands are merged while waiting
+                delay = self._last + self._interval - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+
+                command = next(iter(self._pending))
+                payload, context, submitted = self._pending.pop(command)
+                self._last = time.monotonic()
+
+                with tracer.resumed(context):
+                    tracer.record("bridge.wait", self._last - submitted)
+                    try:
+                        with tracer.span(f"bridge.{command}"):
+                            await self._handler(command, payload)
+                    except:
+                        logger.exception("Failed to handle command %s", command)
@@ -0,0 +1,64 @@
+import unittest
+
+from types import SimpleNamespace
+from unittest import mock
+
+try:
+    import gateway
+except ImportError:
+    gateway = None
+
+
+@unittest.skipUnless(gateway, "requires bluetooth_mesh and asyncio_mqtt")
+class AddKeysTest(unittest.IsolatedAsyncioTestCase):
+    def _app(self, new_keys):
+        calls = mock.Mock()
+        calls.import_subnet = mock.AsyncMock()
+        calls.add_net_key = mock.AsyncMock()
+        calls.add_app_key = mock.AsyncMock()
+        calls.delete_app_key = mock.AsyncMock()
+
+        app = SimpleNamespace(
+            address=0x0001,
+            net_keys={0: "net0", 1: "net1"},
+            app_keys=[(0, 0, "app0"), (1, 1, "app1")],
+            management_interface=SimpleNamespace(import_subnet=calls.import_subnet),
+            client=lambda model: SimpleNamespace(add_net_key=calls.add_net_key),
+            add_app_key=calls.add_app_key,
+            delete_app_key=calls.delete_app_key,
+            _new_keys=set(new_keys),
+        )
+        app._key_name = lambda kind, index: gateway.MqttGateway._key_name(app, kind, index)
+        return app, calls
+
+    async def test_subnet_before_app_key(self):
+        app, calls = self._app({"network_key_1"})
+
+        await gateway.MqttGateway._add_keys(app)
+
+        self.assertEqual(
+            calls.mock_calls,
+            [
+                mock.call.import_subnet(1, "net1"),
+                mock.call.add_net_key(0x0001, net_index=0, net_key_index=1, net_key="net1"),
+                mock.call.add_app_key(0, 0, "app0"),
+                mock.call.add_app_key(1, 1, "app1"),
+            ],
+        )
+
+    async def test_known_subnet_is_not_imported(self):
+        app, calls = self._app(set())
+
+        await gateway.MqttGateway._add_keys(app)
+
+        calls.import_subnet.assert_not_called()
+        calls.add_net_key.assert_awaited_once_with(0x0001, net_index=0, net_key_index=1, net_key="net1")
+
+    async def test_failed_app_key_does_not_abort(self):
+        app, calls = self._app(set())
+        calls.add_app_key.side_effect = [None, Exception("rejected"), Exception("rejected")]
+
+        with self.assertLogs("gateway", level="ERROR"):
+            await gateway.MqttGateway._add_keys(app)
+
+        calls.delete_app_key.assert_awaited_once_with(1, 1)
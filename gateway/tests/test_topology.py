@@ -0,0 +1,42 @@
+import unittest
+
+try:
+    from modules.topology import plan_relays
+except ImportError:
+    plan_relays = None
+
+
+def graph(*edges, nodes=()):
+    result = {node: set() for node in nodes}
+    for a, b in edges:
+        result.setdefault(a, set()).add(b)
+        result.setdefault(b, set()).add(a)
+    return result
+
+
+@unittest.skipUnless(plan_relays, "requires bluetooth_mesh")
+class PlanRelaysTest(unittest.TestCase):
+    def test_node_next_to_gateway(self):
+        self.assertEqual(plan_relays(graph(("a", "gateway")), excluded=["gateway"]), (set(), set()))
+
+    def test_pair_with_isolated_gateway(self):
+        self.assertEqual(plan_relays(graph(("a", "b"), nodes=["gateway"]), excluded=["gateway"]), (set(), set()))
+
+    def test_clique(self):
+        edges = [("a", "b"), ("a", "c"), ("b", "c"), ("a", "gateway"), ("b", "gateway"), ("c", "gateway")]
+        self.assertEqual(plan_relays(graph(*edges), excluded=["gateway"]), (set(), set()))
+
+    def test_clique_keeps_forced_relays(self):
+        self.assertEqual(
+            plan_relays(graph(("a", "b"), ("a", "gateway"), ("b", "gateway")), forced=["a"]), ({"a"}, set())
+        )
+
+    def test_chain(self):
+        edges = [("gateway", "a"), ("a", "b"), ("b", "c")]
+        self.assertEqual(plan_relays(graph(*edges), excluded=["gateway"]), ({"a", "b"}, set()))
+
+    def test_gateway_behind_excluded_node(self):
+        edges = [("gateway", "a"), ("a", "b")]
+        relays, uncovered = plan_relays(graph(*edges), excluded=["gateway", "a"])
+        self.assertEqual(relays, {"b"})
+        self.assertEqual(uncovered, {"gateway"})
@@ -1,3 +1,9 @@
 from .config import Config
+from .diagnostics import LoopWatchdog, Profiler
+from .logs import setup_logging
+from .loop import LOOPS, install_loop
+from .shard import Shard
 from .store import Store
 from .tasks import Tasks
+from .tracing import tracer, traced
+from .watcher import FileWatcher
@@ -0,0 +1,131 @@
+"""
+Capture of gateway traffic for offline benchmarking
+
+Inbound MQTT commands and all calls to mesh client models are written
+to a gzip compressed JSONL file, one record per line. Every record holds
+the time since the capture was started:
+
+    {"t": 1.25, "mqtt": "homeassistant/light/mqtt_mesh/kitchen/set", "payload": "{...}"}
+    {"t": 1.26, "mesh": "LightLightnessClient.set_lightness_unack", "args": [...], "result": null, "d": 0.002}
+
+Captures can be fed back into the gateway using the replay driver.
+"""
+
+import gzip
+import asyncio
+import time
+import atexit
+import logging
+import functools
+
+from . import codec
+from .logs import queued
+
+
+def encode(value):
+    """
+    Convert call arguments and results into plain JSON data
+
+    Dictionaries with non-string keys (i.e. results by unicast address) and
+    exceptions are tagged, so that they can be restored on replay.
+    """
+    if isinstance(value, BaseException):
+        return {"__error__": type(value).__name__, "message": str(value)}
+    if isinstance(value, dict):
+        if all(isinstance(key, str) for key in value):
+            return {key: encode(item) for key, item in value.items() if not key.startswith("_")}
+        return {"__items__": [[encode(key), encode(item)] for key, item in value.items()]}
+    if isinstance(value, (list, tuple, set)):
+        return [encode(item) for item in value]
+    if isinstance(value, bytes):
+        return value.hex()
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    return repr(value)
+
+
+class Recorder:
+    """
+    Writes captured traffic from a background thread
+    """
+
+    def __init__(self):
+        self._logger = None
+        self._start = None
+
+    @property
+    def enabled(self):
+        return self._logger is not None
+
+    def configure(self, filename):
+        handler = logging.StreamHandler(gzip.open(filename, "wt"))
+        handler.setFormatter(logging.Formatter("%(message)s"))
+
+        # the file is closed after all pending records are written
+        atexit.register(handler.close)
+
+        self._logger = logging.getLogger("capture")
+        self._logger.setLevel(logging.INFO)
+        self._logger.propagate = False
+        self._logger.addHandler(queued(handler))
+        self._start = time.monotonic()
+
+    def _write(self, record):
+        record["t"] = round(time.monotonic() - self._start, 4)
+        self._logger.info(codec.dumps(record).decode())
+
+    def mqtt(self, topic, payload):
+        """
+        Record an inbound MQTT message
+        """
+        if self._logger is not None:
+            self._write({"mqtt": topic, "payload": payload.decode(errors="replace")})
+
+    def mesh(self, name, args, kwargs, result, duration):
+        """
+        Record a call to a mesh client model
+        """
+        if self._logger is not None:
+            self._write(
+                {
+                    "mesh": name,
+                    "args": encode(args),
+                    "kwargs": encode(kwargs),
+                    "result": encode(result),
+                    "d": round(duration, 4),
+                }
+            )
+
+
+recorder = Recorder()
+
+
+class RecordingClient:
+    """
+    Wraps a mesh client model and records all of its requests
+    """
+
+    def __init__(self, client, recorder):
+        self._client = client
+        self._recorder = recorder
+        self._name = type(client).__name__
+
+    def __getattr__(self, name):
+        attribute = getattr(self._client, name)
+        if not asyncio.iscoroutinefunction(attribute):
+            return attribute
+
+        @functools.wraps(attribute)
+        async def call(*args, **kwargs):
+            start = time.monotonic()
+            result = None
+            try:
+                result = await attribute(*args, **kwargs)
+                return result
+            except Exception as e:
+                result = e
+                raise
+            finally:
+                self._recorder.mesh(f"{self._name}.{name}", args, kwargs, result, time.monotonic() - start)
+
+        return call
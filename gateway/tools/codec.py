@@ -0,0 +1,30 @@
+"""
+JSON codec used for all MQTT payloads
+
+Uses orjson if it is installed, which is considerably faster than the
+standard library. Encoded messages are always returned as bytes.
+"""
+
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+if orjson:
+
+    def loads(data):
+        return orjson.loads(data)
+
+    def dumps(data, sort_keys=False):
+        return orjson.dumps(data, option=orjson.OPT_SORT_KEYS if sort_keys else 0)
+
+else:
+
+    def loads(data):
+        return json.loads(data)
+
+    def dumps(data, sort_keys=False):
+        return json.dumps(data, sort_keys=sort_keys).encode()
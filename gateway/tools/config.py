@@ -2,14 +2,22 @@ import yaml
 import logging
 
 
+logger = logging.getLogger(__name__)
+
+
 class Config:
+    # aggregates a sensor can publish as its state
+    AGGREGATES = ("min", "max", "mean", "last")
+
+    # options of areas, that only describe the area itself
+    AREA_OPTIONS = ("name", "summary", "summary_interval")
+
     def __init__(self, filename=None, config=None):
         self._filename = filename
 
         # load user configuration
         if self._filename:
-            with open(self._filename, "r") as config_file:
-                self._config = yaml.safe_load(config_file)
+            self.load()
 
         elif config is not None:
             self._config = config
@@ -17,6 +25,35 @@ class Config:
         else:
             raise Exception("Invalid config initialization")
 
+    def load(self):
+        """
+        Load the configuration file
+
+        The configuration is replaced in place, so that all components
+        see the changes. The current configuration is kept if the file is invalid.
+        """
+        with open(self._filename, "r") as config_file:
+            config = yaml.safe_load(config_file)
+
+        if not isinstance(config, dict):
+            raise Exception(f"Invalid configuration in {self._filename}")
+        self._validate(config)
+        self._config = config
+
+    def _validate(self, config):
+        """
+        Reject settings that would only fail once a node is served
+        """
+        mesh = config.get("mesh", None) or {}
+        areas = config.get("areas", None) or {}
+
+        for id, info in mesh.items():
+            info = {**Config._area_defaults(areas.get(info.get("area"), {})), **info}
+
+            aggregate = info.get("aggregate", "mean")
+            if aggregate not in Config.AGGREGATES:
+                raise Exception(f"Invalid aggregate {aggregate} of {id}, use one of {', '.join(Config.AGGREGATES)}")
+
     def _get(self, path, section, info):
         if "." in path:
             prefix, remainder = path.split(".", 1)
@@ -53,13 +90,20 @@ class Config:
         Get config for given node
         """
         mesh = self.optional("mesh", None) or {}
+        areas = self.optional("areas", None) or {}
 
         for id, info in mesh.items():
             if info.get("uuid") == str(uuid):
-                return Config(config={"id": id, **info})
+                # area settings are used as defaults for the node
+                area = Config._area_defaults(areas.get(info.get("area"), {}))
+                return Config(config={"id": id, **area, **info})
 
-        logging.warning(f"Missing configuration for node {uuid}")
+        logger.warning("Missing configuration for node %s", uuid)
         return Config(config={})
 
+    @staticmethod
+    def _area_defaults(area):
+        return {key: value for key, value in area.items() if key not in Config.AREA_OPTIONS}
+
     def items(self):
         return self._config.items()
@@ -0,0 +1,151 @@
+import os
+import sys
+import time
+import asyncio
+import cProfile
+import logging
+import statistics
+import threading
+import traceback
+
+from collections import deque
+
+
+logger = logging.getLogger(__name__)
+
+
+class LoopWatchdog:
+    """
+    Measures how late the event loop wakes up
+
+    A task on the event loop sleeps for a fixed interval and records the
+    lag, by which it woke up late. A background thread logs the stack of the
+    event loop thread, whenever the task did not wake up for longer than
+    the stall threshold. Lag percentiles are logged and reported periodically.
+    """
+
+    def __init__(self, config):
+        self._enabled = config.optional("diagnostics.watchdog", True)
+        self._interval = config.optional("diagnostics.interval", 0.5)
+        self._stall = config.optional("diagnostics.stall", 1.0)
+        self._report = config.optional("diagnostics.report", 60)
+
+        self._lags = deque(maxlen=max(int(self._report / self._interval), 1))
+        self._heartbeat = time.monotonic()
+        self._stalls = 0
+
+    def percentiles(self):
+        """
+        Lag percentiles of the last report period in milliseconds
+        """
+        lags = sorted(lag * 1000 for lag in self._lags)
+        if len(lags) < 2:
+            return None
+
+        quantiles = statistics.quantiles(lags, n=100, method="inclusive")
+        return {
+            "p50": round(quantiles[49], 2),
+            "p95": round(quantiles[94], 2),
+            "p99": round(quantiles[98], 2),
+            "max": round(lags[-1], 2),
+            "stalls": self._stalls,
+        }
+
+    def _watch(self, thread_id, stopped):
+        reported = None
+        while not stopped.wait(self._interval):
+            heartbeat = self._heartbeat
+            if time.monotonic() - heartbeat < self._stall or heartbeat == reported:
+                continue
+
+            # report every stall only once
+            reported = heartbeat
+            self._stalls += 1
+
+            frame = sys._current_frames().get(thread_id)
+            stack = "".join(traceback.format_stack(frame)) if frame else "unknown"
+            logger.warning("Event loop stalled for more than %.1fs in:\n%s", self._stall, stack)
+
+    async def run(self, report=None):
+        """
+        Monitor the running loop and pass percentiles to the report callback
+        """
+        if not self._enabled:
+            return
+
+        stopped = threading.Event()
+        thread = threading.Thread(
+            target=self._watch, args=(threading.get_ident(), stopped), name="watchdog", daemon=True
+        )
+        thread.start()
+
+        last_report = time.monotonic()
+        try:
+            while True:
+                self._heartbeat = time.monotonic()
+                await asyncio.sleep(self._interval)
+
+                now = time.monotonic()
+                self._lags.append(max(now - self._heartbeat - self._interval, 0))
+
+                if now - last_report < self._report:
+                    continue
+                last_report = now
+
+                percentiles = self.percentiles()
+                if percentiles is None:
+                    continue
+
+                logger.info(
+                    "Loop lag p50 %sms, p95 %sms, p99 %sms, max %sms",
+                    percentiles["p50"],
+                    percentiles["p95"],
+                    percentiles["p99"],
+                    percentiles["max"],
+                )
+                if report:
+                    try:
+                        await report(percentiles)
+                    except:
+                        logger.exception("Failed to report loop lag")
+        finally:
+            stopped.set()
+
+
+class Profiler:
+    """
+    Captures time-boxed profiles of the running gateway
+
+    Profiles are written in the cProfile format to the base directory and can
+    be inspected using pstats or snakeviz.
+    """
+
+    def __init__(self, config, basedir):
+        self._basedir = basedir
+        self._duration = config.optional("diagnostics.profile_duration", 10)
+        self._lock = asyncio.Lock()
+
+    async def profile(self, duration=None):
+        """
+        Profile the event loop thread for the given duration
+
+        Returns the filename of the profile.
+        """
+        if self._lock.locked():
+            raise Exception("Profile already running")
+
+        async with self._lock:
+            duration = duration or self._duration
+            filename = os.path.join(self._basedir, time.strftime("profile-%Y%m%d-%H%M%S.prof"))
+
+            logger.info("Profiling for %ss...", duration)
+            profile = cProfile.Profile()
+            profile.enable()
+            try:
+                await asyncio.sleep(duration)
+            finally:
+                profile.disable()
+
+            profile.dump_stats(filename)
+            logger.info("Profile written to %s", filename)
+            return filename
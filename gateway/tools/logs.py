@@ -0,0 +1,45 @@
+import queue
+import atexit
+import logging
+
+from logging.handlers import QueueHandler, QueueListener
+
+
+# loggers that can be configured individually
+SUBSYSTEMS = ["gateway", "mesh", "mqtt", "modules", "tools"]
+
+
+def queued(handler):
+    """
+    Wrap a handler, so that records are written from a background thread
+
+    The background thread is stopped and all pending records are written on exit.
+    """
+    records = queue.SimpleQueue()
+    listener = QueueListener(records, handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+
+    return QueueHandler(records)
+
+
+def setup_logging(config):
+    """
+    Configure logging from the logging section in config.yaml
+
+    Sets the overall log level and optional levels for every subsystem.
+    Logging never blocks the event loop, since all output is written
+    from a background thread.
+    """
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter(config.optional("logging.format", logging.BASIC_FORMAT)))
+
+    root = logging.getLogger()
+    root.handlers.clear()
+    root.addHandler(queued(handler))
+    root.setLevel(config.optional("logging.level", "info").upper())
+
+    for subsystem in SUBSYSTEMS:
+        level = config.optional(f"logging.{subsystem}")
+        if level:
+            logging.getLogger(subsystem).setLevel(level.upper())
@@ -0,0 +1,31 @@
+import asyncio
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+# available event loop implementations
+LOOPS = ["asyncio", "uvloop"]
+
+
+def install_loop(name):
+    """
+    Install the event loop policy for the given loop implementation
+
+    Falls back to the default asyncio loop if uvloop is not installed.
+    Must be called before the event loop is created.
+    """
+    if name not in LOOPS:
+        raise Exception(f"Unknown event loop {name}")
+
+    if name == "uvloop":
+        try:
+            import uvloop
+        except ImportError:
+            logger.warning("uvloop is not installed, using the asyncio event loop")
+            return "asyncio"
+
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+
+    return name
@@ -0,0 +1,283 @@
+"""
+Replay of captured gateway traffic
+
+Captured MQTT commands are fed into the gateway at their original pace or
+accelerated. Mesh client models are replaced by stubs, that answer with the
+captured results after the captured duration. MQTT messages published by
+the gateway are counted, but never leave the process.
+"""
+
+import gzip
+import time
+import asyncio
+import logging
+import statistics
+
+from collections import defaultdict, deque
+from types import SimpleNamespace
+
+from . import codec
+
+
+logger = logging.getLogger(__name__)
+
+
+class Record(dict):
+    """
+    Decoded dictionary, that also allows attribute access like construct containers
+    """
+
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name)
+
+
+def decode(value):
+    """
+    Restore call arguments and results encoded by the capture
+    """
+    if isinstance(value, dict):
+        if "__error__" in value:
+            if value["__error__"] == "TimeoutError":
+                return asyncio.TimeoutError(value["message"])
+            return Exception(value["message"])
+        if "__items__" in value:
+            return {decode(key): decode(item) for key, item in value["__items__"]}
+        return Record((key, decode(item)) for key, item in value.items())
+    if isinstance(value, list):
+        return [decode(item) for item in value]
+    return value
+
+
+def destinations(args):
+    """
+    Get the addresses a mesh request is sent to
+    """
+    if not args:
+        return []
+    if isinstance(args[0], (list, tuple)):
+        return list(args[0])
+    return [args[0]]
+
+
+def matches(topic_filter, topic):
+    """
+    Check if a topic matches an MQTT subscription
+    """
+    parts = topic.split("/")
+    for index, part in enumerate(topic_filter.split("/")):
+        if part == "#":
+            return True
+        if index >= len(parts) or (part != "+" and part != parts[index]):
+            return False
+    return len(parts) == len(topic_filter.split("/"))
+
+
+class StubClient:
+    """
+    Stands in for a mesh client model
+
+    Requests are answered with the captured result for the same request
+    and destination. Requests that were not captured are answered empty.
+    """
+
+    def __init__(self, name, replayer):
+        self._name = name
+        self._replayer = replayer
+        self.app_message_callbacks = defaultdict(set)
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+
+        async def call(*args, **kwargs):
+            targets = destinations(args)
+            self._replayer.sent(targets)
+
+            result, duration = self._replayer.result(f"{self._name}.{name}", targets)
+            await asyncio.sleep(duration / self._replayer.speed)
+
+            if isinstance(result, BaseException):
+                raise result
+            if result is None and isinstance(args[0] if args else None, list):
+                return {target: None for target in targets}
+            return result
+
+        call.__name__ = name
+        return call
+
+
+class LoopbackClient:
+    """
+    Stands in for the MQTT client
+
+    Injected messages are passed to all matching message filters.
+    """
+
+    def __init__(self):
+        self._filters = []
+        self.published = 0
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        pass
+
+    async def subscribe(self, *args, **kwargs):
+        pass
+
+    async def unsubscribe(self, *args, **kwargs):
+        pass
+
+    async def publish(self, topic, payload=None, **kwargs):
+        self.published += 1
+
+    def filtered_messages(self, topic_filter):
+        return _Subscription(self._filters, topic_filter)
+
+    def inject(self, topic, payload):
+        message = SimpleNamespace(topic=topic, payload=payload, timestamp=time.monotonic())
+        for topic_filter, queue in self._filters:
+            if matches(topic_filter, topic):
+                queue.put_nowait(message)
+
+
+class _Subscription:
+    def __init__(self, filters, topic_filter):
+        self._filters = filters
+        self._entry = (topic_filter, asyncio.Queue())
+
+    async def __aenter__(self):
+        self._filters.append(self._entry)
+        return self._messages()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self._filters.remove(self._entry)
+
+    async def _messages(self):
+        while True:
+            yield await self._entry[1].get()
+
+
+class Replayer:
+    """
+    Feeds a capture back into the gateway
+
+    The latency of a command is the time from feeding it until the first
+    mesh request to the commanded node. Commands that were replaced by newer
+    ones before being sent are counted as merged.
+    """
+
+    # time without mesh requests after which the replay is finished
+    QUIET_TIME = 2.0
+
+    def __init__(self, filename, speed=1.0):
+        self.speed = speed
+        self.loopback = LoopbackClient()
+
+        self._commands = []
+        self._results = defaultdict(deque)
+        self._pending = defaultdict(list)
+        self._latencies = []
+        self._requests = 0
+        self._last_request = 0
+
+        with gzip.open(filename, "rt") as capture:
+            for line in capture:
+                record = codec.loads(line)
+                if "mqtt" in record:
+                    self._commands.append((record["t"], record["mqtt"], record["payload"].encode()))
+                elif "mesh" in record:
+                    targets = destinations(decode(record["args"]))
+                    self._results[(record["mesh"], tuple(targets))].append((decode(record["result"]), record["d"]))
+
+        logger.info("Loaded %s command(s) and %s mesh request(s)", len(self._commands), self.requests_captured)
+
+    @property
+    def requests_captured(self):
+        return sum(len(results) for results in self._results.values())
+
+    def stub(self, model):
+        return StubClient(model.__name__, self)
+
+    def result(self, name, targets):
+        """
+        Get the next captured result and duration of a request
+        """
+        results = self._results.get((name, tuple(targets)))
+        if not results:
+            return None, 0
+        return results.popleft()
+
+    def sent(self, targets):
+        """
+        Resolve the latency of all commands waiting for one of the given nodes
+        """
+        now = time.monotonic()
+        self._requests += 1
+        self._last_request = now
+
+        for target in targets:
+            self._latencies.extend(now - fed for fed in self._pending.pop(target, []))
+
+    async def run(self, nodes):
+        """
+        Feed all captured commands and report the results
+        """
+        addresses = {}
+        for node in nodes:
+            try:
+                await asyncio.wait_for(node.ready.wait(), self.QUIET_TIME * 10)
+            except asyncio.TimeoutError:
+                logger.warning("%s is not ready", node)
+            unicast = getattr(node, "unicast", None)
+            if unicast is None:
+                continue
+
+            # every element is a separate entity
+            for element in node.elements:
+                id = node.config.optional("id")
+                addresses[f"{id}_{element}" if element else id] = unicast + element
+
+        # give bridges a moment to subscribe
+        await asyncio.sleep(0.5)
+
+        logger.info("Replaying %s command(s) at %sx speed...", len(self._commands), self.speed)
+
+        begin = time.monotonic()
+        cpu = time.process_time()
+        offset = self._commands[0][0] if self._commands else 0
+        for t, topic, payload in self._commands:
+            delay = (t - offset) / self.speed - (time.monotonic() - begin)
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+            unicast = addresses.get(topic.split("/")[-2])
+            if unicast is not None:
+                self._pending[unicast].append(time.monotonic())
+            self.loopback.inject(topic, payload)
+
+        # wait for all commands to be handled
+        while time.monotonic() - max(self._last_request, begin) < self.QUIET_TIME:
+            await asyncio.sleep(0.1)
+
+        self.report(time.monotonic() - begin - self.QUIET_TIME, time.process_time() - cpu)
+
+    def report(self, elapsed, cpu):
+        merged = sum(len(pending) for pending in self._pending.values())
+        print(f"commands:   {len(self._commands)} in {elapsed:.2f}s ({len(self._commands) / max(elapsed, 1e-3):.1f}/s)")
+        print(f"requests:   {self._requests} sent, {self.requests_captured} captured results left")
+        print(f"published:  {self.loopback.published}")
+        print(f"cpu:        {cpu:.2f}s ({cpu / max(elapsed, 1e-3) * 100:.0f}%)")
+        print(f"merged:     {merged}")
+
+        if len(self._latencies) >= 2:
+            latencies = sorted(latency * 1000 for latency in self._latencies)
+            quantiles = statistics.quantiles(latencies, n=100, method="inclusive")
+            print(
+                f"latency:    p50 {quantiles[49]:.2f}ms, p95 {quantiles[94]:.2f}ms, "
+                f"p99 {quantiles[98]:.2f}ms, max {latencies[-1]:.2f}ms"
+            )
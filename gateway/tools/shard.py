@@ -0,0 +1,65 @@
+import zlib
+
+
+class Shard:
+    """
+    Assignment of nodes to gateway shards
+
+    Multiple gateway processes can share a single mesh network, each serving
+    a shard of the configured nodes. Nodes are assigned explicitly using the
+    shard option or implicitly by a stable hash of their id.
+
+    Every shard uses its own range of unicast addresses.
+    """
+
+    UNICAST_RANGE = (0x0001, 0x7FFF)
+
+    def __init__(self, config, name=None):
+        self.name = name
+        self._shards = config.optional("shards", None) or []
+
+        if self.name is not None and self.name not in self._shards:
+            raise Exception(f'Unknown shard "{self.name}"')
+
+    def __str__(self):
+        return self.name or "default"
+
+    @property
+    def enabled(self):
+        return self.name is not None
+
+    @property
+    def address_range(self):
+        """
+        Unicast addresses that are used by this shard
+        """
+        first, last = Shard.UNICAST_RANGE
+        if not self.enabled:
+            return first, last
+
+        size = (last - first + 1) // len(self._shards)
+        start = first + self._shards.index(self.name) * size
+        return start, start + size - 1
+
+    def assigned(self, id, config):
+        """
+        Get the names of all shards an entity is assigned to
+
+        The order of the returned shards defines their precedence.
+        """
+        shard = config.optional("shard")
+
+        if shard is None:
+            if not self._shards or id is None:
+                return []
+            return [self._shards[zlib.crc32(id.encode()) % len(self._shards)]]
+
+        if isinstance(shard, list):
+            return shard
+        return [shard]
+
+    def owns(self, id, config):
+        """
+        Check if an entity is assigned to this shard
+        """
+        return not self.enabled or self.name in self.assigned(id, config)
@@ -7,9 +7,10 @@ class Store:
     Provides a simple database structure
     """
 
-    def __init__(self, delegate=None, location=None, data=None):
+    def __init__(self, delegate=None, location=None, data=None, readonly=False):
         self._location = location
         self._delegate = delegate
+        self._readonly = readonly
 
         if not self._location and not self._delegate:
             raise Exception("Either delegate or location must be specified")
@@ -32,7 +33,7 @@ class Store:
             # persist using parent location
             self._delegate.persist()
 
-        if self._location:
+        if self._location and not self._readonly:
             # persist to actual location
             with open(self._location, "w") as store_file:
                 yaml.dump(self._data, store_file)
@@ -2,6 +2,9 @@ import asyncio
 import logging
 
 
+logger = logging.getLogger(__name__)
+
+
 class Tasks:
     """
     Simple task pool
@@ -31,17 +34,22 @@ class Tasks:
 
     async def _runner(self, task, name):
         if name:
-            logging.debug(f"Spawning task to {name}...")
+            logger.debug("Spawning task to %s...", name)
         try:
             await task
+        except asyncio.CancelledError:
+            logger.debug("%s cancelled", name)
+            return
         except:
-            logging.exception("Task failed")
+            logger.exception("Task failed")
         if name:
-            logging.debug(f"{name} completed")
+            logger.debug("%s completed", name)
 
     def spawn(self, task, name=None):
-        self._tasks.add(asyncio.create_task(self._runner(task, name)))
+        task = asyncio.create_task(self._runner(task, name))
+        self._tasks.add(task)
+        return task
 
     async def gather(self):
-        logging.info(f"Awaiting {len(self._tasks)} tasks")
+        logger.info("Awaiting %s tasks", len(self._tasks))
         await asyncio.gather(*self._tasks)
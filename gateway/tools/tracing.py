@@ -0,0 +1,144 @@
+import os
+import time
+import random
+import secrets
+import logging
+import functools
+import contextvars
+
+from contextlib import contextmanager
+from logging.handlers import RotatingFileHandler
+
+from . import codec
+from .logs import queued
+
+
+# trace and span of the currently running command
+_trace = contextvars.ContextVar("trace", default=None)
+_span = contextvars.ContextVar("span", default=None)
+
+
+class Tracer:
+    """
+    Records timed spans for incoming MQTT commands
+
+    A trace is started for a sampled subset of incoming commands. Trace and span
+    are kept in context variables, so they follow the command through all awaited
+    calls and through tasks spawned from them. Spans are written to a rotating
+    JSONL file.
+    """
+
+    def __init__(self):
+        self._rate = 0
+        self._logger = None
+
+    def configure(self, config, basedir):
+        self._rate = config.optional("tracing.sample_rate", 0)
+        if not self._rate:
+            return
+
+        handler = RotatingFileHandler(
+            os.path.join(basedir, config.optional("tracing.file", "traces.jsonl")),
+            maxBytes=config.optional("tracing.max_bytes", 10 * 1024 * 1024),
+            backupCount=config.optional("tracing.backups", 3),
+        )
+        handler.setFormatter(logging.Formatter("%(message)s"))
+
+        self._logger = logging.getLogger("tracing")
+        self._logger.setLevel(logging.INFO)
+        self._logger.propagate = False
+        self._logger.addHandler(queued(handler))
+
+    def _write(self, trace, span, parent, name, start, duration, attributes):
+        record = {
+            "trace": trace,
+            "span": span,
+            "parent": parent,
+            "name": name,
+            "start": start,
+            "duration": round(duration * 1000, 3),
+            **attributes,
+        }
+        self._logger.info(codec.dumps(record).decode())
+
+    @contextmanager
+    def trace(self, name, **attributes):
+        """
+        Start a new trace if the current call is sampled
+        """
+        if not self._rate or random.random() >= self._rate:
+            yield None
+            return
+
+        token = _trace.set(secrets.token_hex(8))
+        try:
+            with self.span(name, **attributes):
+                yield _trace.get()
+        finally:
+            _trace.reset(token)
+
+    @contextmanager
+    def span(self, name, **attributes):
+        """
+        Record a timed span within the current trace
+        """
+        trace = _trace.get()
+        if trace is None:
+            yield
+            return
+
+        parent = _span.get()
+        token = _span.set(secrets.token_hex(4))
+        start = time.time()
+        begin = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._write(trace, _span.get(), parent, name, start, time.perf_counter() - begin, attributes)
+            _span.reset(token)
+
+    def context(self):
+        """
+        Get the current trace context to resume it elsewhere
+        """
+        return _trace.get(), _span.get()
+
+    @contextmanager
+    def resumed(self, context):
+        """
+        Resume a trace context, i.e. within another task
+        """
+        trace_token = _trace.set(context[0])
+        span_token = _span.set(context[1])
+        try:
+            yield
+        finally:
+            _span.reset(span_token)
+            _trace.reset(trace_token)
+
+    def record(self, name, duration, **attributes):
+        """
+        Record a span that was measured elsewhere
+        """
+        trace = _trace.get()
+        if trace is not None:
+            self._write(trace, secrets.token_hex(4), _span.get(), name, time.time() - duration, duration, attributes)
+
+
+tracer = Tracer()
+
+
+def traced(name):
+    """
+    Record a span for every call of the decorated coroutine function
+    """
+
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            with tracer.span(name):
+                return await func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
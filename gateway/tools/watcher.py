@@ -0,0 +1,44 @@
+import os
+import asyncio
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+class FileWatcher:
+    """
+    Polls a file for modifications
+
+    Polling is used instead of file system notifications, since it works
+    reliably for files mounted into containers.
+    """
+
+    def __init__(self, filename, interval=2.0):
+        self._filename = filename
+        self._interval = interval
+
+    def _mtime(self):
+        try:
+            return os.stat(self._filename).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    async def watch(self, callback):
+        """
+        Call the given coroutine function whenever the file changed
+        """
+        mtime = self._mtime()
+
+        while True:
+            await asyncio.sleep(self._interval)
+
+            current = self._mtime()
+            if current == mtime:
+                continue
+            mtime = current
+
+            try:
+                await callback()
+            except:
+                logger.exception("Failed to handle changes of %s", self._filename)